@@ -0,0 +1,76 @@
+#!/usr/bin/env python2
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+
+Compares the write and read throughput of StorageDirectory and StorageHDF5.
+'''
+
+from __future__ import division
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from data_storage.backend.directory import StorageDirectory
+from data_storage.backend.hdf5 import StorageHDF5
+
+
+# number and shapes of the arrays that are stored
+SHAPES = [(1000, (16,)), (200, (256, 256)), (20, (128, 128, 128))]
+
+
+
+def get_storages():
+    """ returns the storages that are compared """
+    file_tmp = tempfile.NamedTemporaryFile(suffix='.hdf5', delete=False)
+    yield 'hdf5', StorageHDF5(file_tmp.name, temporary=True)
+    file_tmp = tempfile.NamedTemporaryFile(suffix='.hdf5', delete=False)
+    yield 'hdf5 (memmap)', StorageHDF5(file_tmp.name, temporary=True,
+                                       memmap=True)
+    yield 'directory', StorageDirectory(tempfile.mkdtemp(), temporary=True)
+    yield 'directory (mmap)', StorageDirectory(tempfile.mkdtemp(),
+                                               temporary=True, mmap_mode='r')
+
+
+
+def benchmark(storage, data):
+    """ returns the write and the read throughput in items per second """
+    args_list = [(i,) for i in range(len(data))]
+    t_start = time.time()
+    for arr, args in zip(data, args_list):
+        storage.store(arr, args)
+    t_write = time.time() - t_start
+
+    t_start = time.time()
+    for args in args_list:
+        # access the data, such that memory maps are also read
+        storage.retrieve(args, {})[0].sum()
+    t_read = time.time() - t_start
+
+    return len(data) / t_write, len(data) / t_read
+
+
+
+def main():
+    """ run the benchmark """
+    for num_items, shape in SHAPES:
+        data = [np.random.random(shape) for _ in range(num_items)]
+        print('%d arrays of shape %s (%.1f MB in total)'
+              % (num_items, shape, sum(arr.nbytes for arr in data) / 2**20))
+        print('  %-18s %14s %14s' % ('storage', 'write [1/s]', 'read [1/s]'))
+        for name, storage in get_storages():
+            write, read = benchmark(storage, data)
+            print('  %-18s %14.1f %14.1f' % (name, write, read))
+        print('')
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python2
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+
+Compares the file size and the throughput of StorageHDF5 for different options
+of compressing and chunking the stored arrays.
+'''
+
+from __future__ import division
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from data_storage.backend.hdf5 import StorageHDF5
+
+
+# options that are compared
+OPTIONS = [('none', {}),
+           ('chunked', {'chunks': 'auto'}),
+           ('gzip', {'compression': 'gzip'}),
+           ('gzip+shuffle', {'compression': 'gzip', 'shuffle': True}),
+           ('lzf', {'compression': 'lzf'}),
+           ('lzf+shuffle', {'compression': 'lzf', 'shuffle': True})]
+
+# shapes of the arrays that are stored
+SHAPES = [(4096,), (256, 256), (64, 64, 64)]
+
+
+
+def get_data(shape, num_items):
+    """ returns smooth and thus compressible test data """
+    grids = np.meshgrid(*[np.linspace(0, 1, n) for n in shape],
+                        indexing='ij')
+    field = sum(np.sin(2 * np.pi * (i + 1) * g) for i, g in enumerate(grids))
+    return [np.round(field, 3) + i for i in range(num_items)]
+    
+    
+    
+def benchmark(data, options):
+    """ returns the file size, the write and the read throughput """
+    file_tmp = tempfile.NamedTemporaryFile(suffix='.hdf5', delete=False)
+    storage = StorageHDF5(file_tmp.name, temporary=True, **options)
+    
+    args_list = [(i,) for i in range(len(data))]
+    t_start = time.time()
+    storage.store_many(data, args_list)
+    t_write = time.time() - t_start
+    
+    t_start = time.time()
+    storage.retrieve_many(args_list)
+    t_read = time.time() - t_start
+    
+    nbytes = sum(arr.nbytes for arr in data)
+    size = os.stat(file_tmp.name).st_size
+    return size, nbytes / t_write, nbytes / t_read
+
+
+
+def main():
+    """ run the benchmark """
+    for shape in SHAPES:
+        data = get_data(shape, num_items=20)
+        print('Arrays of shape %s (%.1f MB in total)'
+              % (shape, sum(arr.nbytes for arr in data) / 2**20))
+        print('  %-14s %10s %14s %14s'
+              % ('options', 'size [MB]', 'write [MB/s]', 'read [MB/s]'))
+        for name, options in OPTIONS:
+            size, write, read = benchmark(data, options)
+            print('  %-14s %10.2f %14.1f %14.1f'
+                  % (name, size / 2**20, write / 2**20, read / 2**20))
+        print('')
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python2
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+
+Measures the latency of cache hits of a StorageHDF5 with and without keeping
+the hdf5 file open between operations.
+'''
+
+from __future__ import division
+
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from data_storage.backend.hdf5 import StorageHDF5
+
+
+
+def benchmark(keep_open, num_items=100, repeat=2000):
+    """ returns the mean time of a cache hit in seconds """
+    file_tmp = tempfile.NamedTemporaryFile(suffix='.hdf5', delete=False)
+    storage = StorageHDF5(file_tmp.name, temporary=True, keep_open=keep_open)
+    for i in range(num_items):
+        storage.store(np.random.randn(16), args=(i,))
+    
+    args = [((i % num_items,), {}) for i in range(repeat)]
+    def retrieve_all():
+        for a, k in args:
+            storage.retrieve(a, k)
+    
+    return min(timeit.repeat(retrieve_all, number=1, repeat=3)) / repeat
+
+
+
+def main():
+    """ run the benchmark """
+    t_closed = benchmark(keep_open=False)
+    t_open = benchmark(keep_open=True)
+    print('Latency per cache hit:')
+    print('  reopening file: %8.1f us' % (1e6 * t_closed))
+    print('  keeping open:   %8.1f us' % (1e6 * t_open))
+    print('  speed-up:       %8.1f x' % (t_closed / t_open))
+
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from backend.memory import StorageMemory
+from backend.memory import StorageMemory, StorageMemoryBounded
 
 from provider.cache import cached
 from provider.interpolate import interpolated
\ No newline at end of file
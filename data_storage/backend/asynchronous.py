@@ -0,0 +1,110 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+
+Facade that makes storages usable from an asyncio event loop. The blocking
+methods of the storage are run in an executor and futures of their results are
+returned. This module requires either `asyncio` or its backport `trollius`.
+'''
+
+from __future__ import division
+
+import functools
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None #< asynchronous storages are not available
+
+
+
+class StorageAsync(object):
+    """ facade of a storage whose methods return futures instead of blocking
+    the event loop. The methods of the storage are run using `executor`. If it
+    is None, the default executor of the event loop is used. Since the storage
+    is then accessed by several threads, it must be thread-safe.
+    """
+
+
+    def __init__(self, storage, executor=None, loop=None):
+        """ initialize the facade
+
+        `storage` is the storage that holds the items
+        `executor` is used for calling the methods of the storage
+        `loop` is the event loop that the futures belong to. If it is None,
+            the current event loop is used.
+        """
+        if asyncio is None:
+            raise ImportError('Asynchronous storages require `asyncio` or '
+                              '`trollius`')
+        self.storage = storage
+        self.executor = executor
+        self._loop = loop
+
+
+    @property
+    def loop(self):
+        """ the event loop that the futures belong to """
+        if self._loop is None:
+            return asyncio.get_event_loop()
+        else:
+            return self._loop
+
+
+    def _run(self, method, *args, **kwargs):
+        """ runs `method` with the given arguments in the executor and
+        returns a future of the result """
+        return self.loop.run_in_executor(self.executor,
+                                         functools.partial(method, *args,
+                                                           **kwargs))
+
+
+    def get_key(self, *args):
+        """ returns a key suitable for caching. The key is built directly,
+        since this does not involve any I/O. """
+        return self.storage.get_key(*args)
+
+
+    def contains(self, key):
+        """ returns a future determining whether an item with the given `key`
+        is stored """
+        return self._run(self.storage.__contains__, key)
+
+
+    def retrieve(self, args=None, kwargs=None, selection=None):
+        """ returns a future of the data retrieved for the given arguments,
+        see `StorageBase.retrieve` """
+        return self._run(self.storage.retrieve, args, kwargs,
+                         selection=selection)
+
+
+    def retrieve_many(self, args_list, kwargs_list=None, skip_missing=False):
+        """ returns a future of the data retrieved for many arguments, see
+        `StorageBase.retrieve_many` """
+        return self._run(self.storage.retrieve_many, args_list, kwargs_list,
+                         skip_missing=skip_missing)
+
+
+    def store(self, result, args=None, kwargs=None, internal_data=None):
+        """ stores data based on given arguments and returns a future that is
+        done when the data has been stored """
+        return self._run(self.storage.store, result, args, kwargs,
+                         internal_data)
+
+
+    def store_many(self, results, args_list=None, kwargs_list=None,
+                   internal_data=None):
+        """ stores many results at once and returns a future that is done when
+        the data has been stored """
+        return self._run(self.storage.store_many, results, args_list,
+                         kwargs_list, internal_data)
+
+
+    def clear(self, time_max=None, kwargs=None):
+        """ clears items from the storage, see `StorageBase.clear`, and returns
+        a future that is done when the items have been removed """
+        return self._run(self.storage.clear, time_max, kwargs)
@@ -9,11 +9,17 @@ array or a instance of CacheObject, which has information of how to save and
 read data.
 '''
 
+import bisect
+import contextlib
+import hashlib
+import itertools
 import logging
 import time
 import sys
 
-import json
+import numpy as np
+
+from .keys import KeyBuilder
 
         
         
@@ -31,23 +37,179 @@ class StorageBase(object):
     This class is an abstract base class, which must be subclassed. Required
     methods to overwrite are __getitem__, __setitem__, __iter__, which have to 
     return/accept a tuple (result, args, kwargs). 
+    
+    Subclasses also need to maintain the secondary index, which maps the
+    keyword arguments and the storage times to the keys, by calling
+    `_add_to_secondary_index` and `_remove_from_secondary_index` whenever
+    items are added or removed.
     """
     
-    def __init__(self, typed_keys=False, strict_keys=False):
-        """ initialize the storage object """
+    def __init__(self, typed_keys=False, strict_keys=False, key_builder=None):
+        """ initialize the storage object
+        
+        `key_builder` is a callable turning the arguments of a function call
+            into a key. If it is None, a `KeyBuilder` is used.
+        """
         super(StorageBase, self).__init__()
+        if key_builder is None:
+            key_builder = KeyBuilder()
+        self.key_builder = key_builder
+        self._reset_secondary_index()
+        
+        
+    def _reset_secondary_index(self):
+        """ removes all items from the secondary index """
+        self._kwargs_index = {} #< kwargs key => set of keys
+        self._time_index = [] #< sorted list of (time_stored, key)
+        self._secondary_entries = {} #< key => (kwargs key, time_stored)
+        
+        
+    def get_kwargs_key(self, kwargs):
+        """ returns a key identifying the keyword arguments `kwargs` """
+        if kwargs is None:
+            kwargs = {}
+        return self.get_key(kwargs)
+        
+        
+    def _add_to_secondary_index(self, key, kwargs, time_stored,
+                                kwargs_key=None):
+        """ adds the item with the given `key` to the secondary index. The
+        key of the keyword arguments can be supplied as `kwargs_key` if it is
+        already known """
+        if key in self._secondary_entries:
+            self._remove_from_secondary_index(key)
+        
+        if kwargs_key is None:
+            kwargs_key = self.get_kwargs_key(kwargs)
+        if time_stored is None or time_stored != time_stored:
+            # items without a valid time are never removed based on the time
+            time_stored = float('inf')
+        
+        self._kwargs_index.setdefault(kwargs_key, set()).add(key)
+        bisect.insort(self._time_index, (time_stored, key))
+        self._secondary_entries[key] = (kwargs_key, time_stored)
+        
+        
+    def _remove_from_secondary_index(self, key):
+        """ removes the item with the given `key` from the secondary index """
+        kwargs_key, time_stored = self._secondary_entries.pop(key)
+        
+        keys = self._kwargs_index[kwargs_key]
+        keys.discard(key)
+        if not keys:
+            del self._kwargs_index[kwargs_key]
+            
+        i = bisect.bisect_left(self._time_index, (time_stored, key))
+        del self._time_index[i]
+        
+        
+    def _keys_with_kwargs(self, kwargs):
+        """ returns the keys of all items stored with the given `kwargs` """
+        kwargs_key = self.get_kwargs_key(kwargs)
+        return list(self._kwargs_index.get(kwargs_key, []))
+    
+    
+    def _times_with_kwargs(self, kwargs):
+        """ returns the keys of all items stored with the given `kwargs`
+        together with the times when the items were stored """
+        entries = self._secondary_entries
+        return [(key, entries[key][1])
+                for key in self._keys_with_kwargs(kwargs)
+                if key in entries]
+    
+    
+    def _keys_stored_before(self, time_max):
+        """ returns the keys of all items stored before `time_max` """
+        i = bisect.bisect_left(self._time_index, (time_max,))
+        return [key for _, key in self._time_index[:i]]
+    
+    
+    def _all_keys(self):
+        """ returns the keys of all items in the storage """
+        return list(self._secondary_entries)
 
 
     def get_key(self, *args):
         """ returns a key suitable for caching """
-        return json.dumps(args, sort_keys=True)
+        return self.key_builder(args)
+    
+    
+    def get_kwargs_version(self, kwargs):
+        """ returns a string that changes whenever items are stored with the
+        given `kwargs`, overwritten, or removed. The version is determined from
+        the keys of the items together with the times they were stored. """
+        lines = ['%s\t%r' % entry
+                 for entry in sorted(self._times_with_kwargs(kwargs))]
+        return hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+    
+    
+    @contextlib.contextmanager
+    def key_lock(self, key):
+        """ context manager that prevents other processes from calculating
+        the item with the given `key` at the same time. Storage backends that
+        can be shared between processes overwrite this method. """
+        yield
 
     
-    def retrieve(self, args=None, kwargs=None):
-        """ retrieves data based on given arguments and not based on the key """
+    def retrieve(self, args=None, kwargs=None, selection=None):
+        """ retrieves data based on given arguments and not based on the key.
+        If `selection` is given, only this part of the stored array is
+        retrieved, e.g. `selection=np.s_[0, :10]` returns the first ten
+        elements of the first row of a two-dimensional array. """
         key = self.get_key(args, kwargs)
         logging.debug('Want to retrieve key `%s`', key)
-        (data_array, args, kwargs, extra_data) = self[key]
+        if selection is None:
+            value = self[key]
+        else:
+            value = self._get_item_selection(key, selection)
+        return self._restore_item(value)
+    
+    
+    def _get_item_selection(self, key, selection):
+        """ returns the value stored for `key`, where the array only contains
+        the part specified by `selection`. Storage backends can overwrite this
+        method to avoid loading the whole array. """
+        data_array, args, kwargs, extra_data = self[key]
+        return np.asarray(data_array)[selection], args, kwargs, extra_data
+    
+    
+    def retrieve_many(self, args_list, kwargs_list=None, skip_missing=False):
+        """ retrieves the data for many arguments at once. `kwargs_list` can
+        either be a list of the keyword arguments belonging to each item of
+        `args_list` or a single dictionary used for all items. A KeyError is
+        raised if an item is not in the storage, unless `skip_missing` is True,
+        in which case None is returned for this item. """
+        keys = [self.get_key(args, kwargs)
+                for args, kwargs in self._iter_arguments(args_list,
+                                                         kwargs_list)]
+        logging.debug('Want to retrieve %d keys', len(keys))
+        
+        result = []
+        for key, value in zip(keys, self._iter_items(keys)):
+            if value is not None:
+                result.append(self._restore_item(value))
+            elif skip_missing:
+                result.append(None)
+            else:
+                raise KeyError(key)
+        return result
+    
+    
+    def _iter_items(self, keys):
+        """ iterates over the values stored for many `keys`. None is returned
+        for keys that are not in the storage. Storage backends can overwrite
+        this method to retrieve the items more efficiently. """
+        for key in keys:
+            try:
+                yield self[key]
+            except KeyError:
+                yield None
+    
+    
+    def _restore_item(self, value):
+        """ restores the result from the value (data_array, args, kwargs,
+        extra_data) that has been read from the storage """
+        (data_array, args, kwargs, extra_data) = value
         
         if 'obj_class' in extra_data:
             # recreate the obj from storage
@@ -72,6 +234,67 @@ class StorageBase(object):
     
     def store(self, result, args=None, kwargs=None, internal_data=None):
         """ store data based on given arguments """
+        key, value = self._prepare_item(result, args, kwargs, internal_data)
+        self[key] = value
+        
+        
+    def store_many(self, results, args_list=None, kwargs_list=None,
+                   internal_data=None):
+        """ store many results at once. `args_list` is a list of the positional
+        arguments belonging to each result and `kwargs_list` is either a list
+        of the associated keyword arguments or a single dictionary used for all
+        results. """
+        items = self._prepare_items(results, args_list, kwargs_list,
+                                    internal_data)
+        self._set_items(items)
+        
+        
+    def _prepare_items(self, results, args_list=None, kwargs_list=None,
+                       internal_data=None):
+        """ returns a list of the keys and values under which the `results`
+        obtained from the given arguments are stored """
+        if args_list is None:
+            args_list = [None] * len(results)
+        items = [self._prepare_item(result, args, kwargs, internal_data)
+                 for result, (args, kwargs)
+                 in zip(results, self._iter_arguments(args_list, kwargs_list))]
+        if len(items) != len(results):
+            raise ValueError('Expected %d arguments, but got %d'
+                             % (len(results), len(items)))
+        
+        # only the last item of each key is stored
+        last = {key: i for i, (key, _) in enumerate(items)}
+        if len(last) < len(items):
+            items = [item for i, item in enumerate(items)
+                     if last[item[0]] == i]
+        return items
+        
+        
+    def _set_items(self, items):
+        """ stores many `items`, which is a list of tuples (key, value). Storage
+        backends can overwrite this method to store the items more
+        efficiently. """
+        for key, value in items:
+            self[key] = value
+            
+            
+    @staticmethod
+    def _iter_arguments(args_list, kwargs_list):
+        """ iterates over pairs of positional and keyword arguments """
+        if kwargs_list is None or isinstance(kwargs_list, dict):
+            kwargs_list = itertools.repeat(kwargs_list)
+        for args, kwargs in itertools.izip(args_list, kwargs_list):
+            if args is None:
+                args = tuple()
+            if kwargs is None:
+                kwargs = {}
+            yield args, kwargs
+        
+        
+    def _prepare_item(self, result, args=None, kwargs=None,
+                      internal_data=None):
+        """ returns the key and the value under which the `result` obtained
+        from the given arguments is stored """
         if args is None:
             args = tuple()
         if kwargs is None:
@@ -98,34 +321,68 @@ class StorageBase(object):
             data_array = result
             logging.debug('Store numpy array to key `%s`', key)
         
-        self[key] = (data_array, args, kwargs, extra_data)
+        return key, (data_array, args, kwargs, extra_data)
        
         
     def iterdata(self, kwargs, ret_extra_data=False):
         """ iterates through all data that is stored with the given kwargs """
-        for value in self.itervalues():
-            c_result, c_args, c_kwargs, c_extra_data = value
-            if c_kwargs == kwargs:
-                if ret_extra_data:
-                    yield c_result, c_args, c_extra_data
-                else:
-                    yield c_result, c_args
+        keys = self._keys_with_kwargs(kwargs)
+        for value in self._iter_items(keys):
+            if value is None:
+                continue #< item has been removed in the meantime
+            c_result, c_args, _, c_extra_data = value
+            if ret_extra_data:
+                yield c_result, c_args, c_extra_data
+            else:
+                yield c_result, c_args
+        
+        
+    def itermeta(self, kwargs=None):
+        """ iterates through the metadata of all items without loading the
+        stored data. The iterator yields tuples (key, args, kwargs,
+        internal_data). If `kwargs` is given, only items stored with these
+        keyword arguments are considered. """
+        if kwargs is None:
+            keys = self._all_keys()
+        else:
+            keys = self._keys_with_kwargs(kwargs)
+        for key, meta in itertools.izip(keys, self._iter_metadata(keys)):
+            if meta is not None:
+                yield (key,) + tuple(meta)
+                
+                
+    def _iter_metadata(self, keys):
+        """ iterates over the metadata (args, kwargs, internal_data) stored for
+        many `keys`. None is returned for keys that are not in the storage.
+        Storage backends should overwrite this method if the metadata can be
+        read without loading the data. """
+        for value in self._iter_items(keys):
+            if value is None:
+                yield None
+            else:
+                yield value[1:]
         
         
     def clear(self, time_max=None, kwargs=None):
         """ clears all items from the storage that have been saved before the
         given time `time_max`. If `time_max` is None, all the data is remove
         """
-        remove = []
-        for key, value in self.iteritems():
-            _, _, c_kwargs, c_internal_data = value
-            delete_item = ((time_max is None
-                            or c_internal_data['time_stored'] < time_max)
-                           and (kwargs is None or c_kwargs == kwargs)) 
-            if delete_item:
-                remove.append(key)
+        if kwargs is not None:
+            remove = set(self._keys_with_kwargs(kwargs))
+            if time_max is not None:
+                remove.intersection_update(self._keys_stored_before(time_max))
+        elif time_max is not None:
+            remove = self._keys_stored_before(time_max)
+        else:
+            remove = self._all_keys()
 
-        for key in remove:
+        self._del_items(remove)
+            
+            
+    def _del_items(self, keys):
+        """ deletes the items with the given `keys`. Storage backends can
+        overwrite this method to delete many items more efficiently. """
+        for key in keys:
             del self[key]
 
         
\ No newline at end of file
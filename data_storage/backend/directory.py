@@ -0,0 +1,439 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+
+Storage that keeps each item in a separate file, such that many processes can
+read the arrays at the same time, e.g., using memory maps.
+'''
+
+from __future__ import division
+
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+
+from .base import StorageBase
+from .keys import json_default
+from .locking import FileLock, KeyFileLock
+
+
+
+class StorageDirectory(StorageBase):
+    """ manages a cache that is stored in a directory
+
+    Each item is stored as a `.npy` file together with a `.json` file holding
+    the arguments and the internal data. The files are placed in the
+    subdirectory `data`, which is sharded by the first characters of the file
+    names. Files are written to a temporary name and then renamed, such that
+    readers never see partially written files.
+
+    The file `INDEX_NAME` is an append-only log mapping the keys to the file
+    names. Each line is a JSON list [key, name, kwargs_key, time_stored] or
+    [key, None] if the item has been deleted. Processes only read the lines
+    that have been appended since they last read the log. Writes to the log
+    are serialized using a file lock and the log is compacted when it contains
+    too many outdated lines.
+    """
+
+    INDEX_NAME = 'index.log'
+    LOCK_NAME = 'index.lock'
+    KEY_LOCK_NAME = 'keys.lock'
+    DATA_DIR = 'data'
+    SHARD_LENGTH = 2 #< number of characters of the name used for sharding
+
+
+    def __init__(self, directory, readonly=False, truncate=False,
+                 temporary=False, mmap_mode=None, key_builder=None,
+                 compact_threshold=1000):
+        """ initialize the storage
+
+        `directory` denotes the directory where the items are stored
+        `readonly` is a flag determining whether the storage is readonly
+        `truncate` is a flag determining whether the storage will be cleared
+            before usage
+        `temporary` indicates whether the directory will be deleted when the
+            objects is deleted
+        `mmap_mode` is passed to `np.load` when arrays are read. If it is 'r',
+            the arrays are returned as read-only memory maps, such that several
+            processes share the same pages of the files.
+        `key_builder` determines how keys are built from the arguments
+        `compact_threshold` is the number of outdated lines in the index log
+            above which the log is rewritten
+        """
+        super(StorageDirectory, self).__init__(key_builder=key_builder)
+
+        self.directory = directory
+        self.readonly = readonly
+        self.temporary = temporary
+        self.mmap_mode = mmap_mode
+        self.compact_threshold = compact_threshold
+
+        self._index_path = os.path.join(directory, self.INDEX_NAME)
+        self._lock = FileLock(os.path.join(directory, self.LOCK_NAME))
+        self._key_lock = KeyFileLock(os.path.join(directory,
+                                                  self.KEY_LOCK_NAME))
+        self._thread_lock = threading.RLock() #< lock for reading the index
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._reset_index()
+        if truncate:
+            self.clear()
+        else:
+            self.refresh_index()
+
+
+    def __del__(self):
+        """ called before the object is destroyed """
+        if getattr(self, 'temporary', False):
+            logging.debug('Delete the storage directory')
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def __getstate__(self):
+        """ return the state for pickling, which excludes the thread lock """
+        state = self.__dict__.copy()
+        del state['_thread_lock']
+        return state
+
+
+    def __setstate__(self, state):
+        """ restore the storage from the pickled state. Only the original
+        storage deletes a temporary directory. """
+        self.__dict__.update(state)
+        self._thread_lock = threading.RLock()
+        self.temporary = False
+
+
+    def _reset_index(self):
+        """ removes all items from the index """
+        self._index = {} #< key => name of the files
+        self._index_inode = None #< inode of the index log that has been read
+        self._index_offset = 0 #< number of bytes of the log that were read
+        self._index_lines = 0 #< number of lines of the log that were read
+        self._reset_secondary_index()
+
+
+    def key_lock(self, key):
+        """ context manager that prevents other processes from calculating
+        the item with the given `key` at the same time """
+        return self._key_lock.acquire(key)
+
+
+    def _get_path(self, name, extension):
+        """ returns the path of the file storing the item `name` """
+        return os.path.join(self.directory, self.DATA_DIR,
+                            name[:self.SHARD_LENGTH], name + extension)
+
+
+    def refresh_index(self):
+        """ reads the lines that other processes appended to the index log.
+        The whole log is read again if it has been compacted. """
+        with self._thread_lock:
+            self._refresh_index()
+
+
+    def _refresh_index(self):
+        """ reads the index log while the thread lock is held """
+        try:
+            stat = os.stat(self._index_path)
+        except OSError:
+            # the index does not exist (anymore)
+            if self._index_inode is not None or self._index:
+                self._reset_index()
+            return
+
+        if (stat.st_ino != self._index_inode or
+                stat.st_size < self._index_offset):
+            logging.debug('Read the full index log')
+            self._reset_index()
+            self._index_inode = stat.st_ino
+
+        if stat.st_size > self._index_offset:
+            with open(self._index_path, 'rb') as fp:
+                fp.seek(self._index_offset)
+                data = fp.read(stat.st_size - self._index_offset)
+            # only read complete lines, since a line might just be written
+            data = data[:data.rfind('\n') + 1]
+            self._index_offset += len(data)
+            for line in data.splitlines():
+                self._apply_index_entry(json.loads(line))
+                self._index_lines += 1
+
+
+    def _apply_index_entry(self, entry):
+        """ applies a single entry of the index log to the index """
+        key = entry[0]
+        if key in self._index:
+            del self._index[key]
+            self._remove_from_secondary_index(key)
+        if entry[1] is not None:
+            self._index[key] = entry[1]
+            self._add_to_secondary_index(key, None, entry[3],
+                                         kwargs_key=entry[2])
+
+
+    def _append_index(self, entries):
+        """ appends `entries` to the index log. The file lock has to be held
+        when calling this method. """
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries)
+        fd = os.open(self._index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+    def compact_index(self):
+        """ rewrite the index log, such that it only contains the current
+        items """
+        if self.readonly:
+            raise IOError('Cannot compact the index of a readonly storage')
+
+        with self._lock.acquire():
+            self.refresh_index()
+            self._compact_index()
+
+
+    def _compact_index(self):
+        """ rewrite the index log while the file lock is held """
+        logging.info('Compact the index log of the storage')
+        entries = [[key, name] + list(self._secondary_entries[key])
+                   for key, name in self._index.iteritems()]
+        path_tmp = self._index_path + '.tmp'
+        with open(path_tmp, 'wb') as fp:
+            for entry in entries:
+                fp.write(json.dumps(entry) + '\n')
+        os.rename(path_tmp, self._index_path)
+        self.refresh_index()
+
+
+    def _check_compact(self):
+        """ compacts the index log if it contains too many outdated lines.
+        The file lock has to be held when calling this method. """
+        if (self.compact_threshold is not None and
+                self._index_lines - len(self._index) > self.compact_threshold):
+            self._compact_index()
+
+
+    def clear(self, time_max=None, kwargs=None):
+        """ clears all items from the storage that have been saved before the
+        given time `time_max`. If `time_max` is None, all the data is remove
+        """
+        if self.readonly:
+            raise IOError('Cannot clear readonly storage')
+
+        if time_max is None and kwargs is None:
+            # the storage will be emptied
+            with self._lock.acquire():
+                self.refresh_index()
+                names = self._index.values()
+                path_tmp = self._index_path + '.tmp'
+                open(path_tmp, 'wb').close()
+                os.rename(path_tmp, self._index_path)
+                self._reset_index()
+                self.refresh_index()
+                
+            # only the files of indexed items are removed, since other
+            # processes might be writing the files of new items
+            self._remove_files(names)
+
+        else:
+            # potentially only a part of the storage will be affected
+            super(StorageDirectory, self).clear(time_max, kwargs)
+
+
+    def _keys_with_kwargs(self, kwargs):
+        """ returns the keys of all items stored with the given `kwargs` """
+        self.refresh_index()
+        return super(StorageDirectory, self)._keys_with_kwargs(kwargs)
+
+
+    def _keys_stored_before(self, time_max):
+        """ returns the keys of all items stored before `time_max` """
+        self.refresh_index()
+        return super(StorageDirectory, self)._keys_stored_before(time_max)
+
+
+    def _all_keys(self):
+        """ returns the keys of all items in the storage """
+        self.refresh_index()
+        return super(StorageDirectory, self)._all_keys()
+
+
+    def __len__(self):
+        """ return length of the storage """
+        self.refresh_index()
+        return len(self._index)
+
+
+    def __contains__(self, key):
+        """ determines whether an item with the given `key` is stored """
+        self.refresh_index()
+        return key in self._index
+
+
+    def _read_metadata(self, name):
+        """ returns the (args, kwargs, internal_data) stored for the item
+        `name` """
+        with open(self._get_path(name, '.json'), 'rb') as fp:
+            meta = json.load(fp)
+        return meta['args'], meta['kwargs'], meta['internal_data']
+
+
+    def _read_item(self, key, mmap_mode):
+        """ reads the item stored with the given `key` """
+        self.refresh_index()
+        name = self._index[key]
+        try:
+            data_array = np.load(self._get_path(name, '.npy'),
+                                 mmap_mode=mmap_mode, allow_pickle=False)
+            args, kwargs, internal_data = self._read_metadata(name)
+        except (IOError, OSError):
+            # the item has been deleted by another process in the meantime
+            raise KeyError(key)
+        return data_array, args, kwargs, internal_data
+
+
+    def __getitem__(self, key):
+        """ retrieve data with given `key` """
+        data_array, args, kwargs, internal_data = \
+            self._read_item(key, self.mmap_mode)
+        if data_array.ndim == 0:
+            data_array = data_array[()]
+        logging.debug('Loaded item `%s` from directory', key)
+        return data_array, args, kwargs, internal_data
+
+
+    def _get_item_selection(self, key, selection):
+        """ retrieve the part `selection` of the data with given `key` by
+        mapping the file into memory and only reading this part """
+        data_array, args, kwargs, internal_data = self._read_item(key, 'r')
+        data_array = data_array[selection]
+        if self.mmap_mode is None:
+            data_array = np.array(data_array)
+        return data_array, args, kwargs, internal_data
+
+
+    def _iter_metadata(self, keys):
+        """ iterates over the metadata of many `keys` by only reading the
+        associated json files """
+        for key in keys:
+            try:
+                yield self._read_metadata(self._index[key])
+            except (KeyError, IOError):
+                yield None
+
+
+    def _write_file(self, path, write):
+        """ writes a file by calling `write` with an open file object and
+        renaming the written file to `path` """
+        path_tmp = path + '.tmp'
+        with open(path_tmp, 'wb') as fp:
+            write(fp)
+        os.rename(path_tmp, path)
+
+
+    def _write_item(self, key, data):
+        """ writes the files of a single item and returns the associated entry
+        for the index """
+        data_array, args, kwargs, internal_data = data
+        data_array = np.asarray(data_array)
+
+        name = uuid.uuid4().hex
+        dirname = os.path.dirname(self._get_path(name, ''))
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                pass #< directory has been created by another process
+
+        meta = {'args': args, 'kwargs': kwargs,
+                'internal_data': internal_data}
+        self._write_file(self._get_path(name, '.json'),
+                         lambda fp: json.dump(meta, fp, default=json_default))
+        self._write_file(self._get_path(name, '.npy'),
+                         lambda fp: np.save(fp, data_array, allow_pickle=False))
+
+        return [key, name, self.get_kwargs_key(kwargs),
+                self._get_time_stored(internal_data)]
+
+
+    @staticmethod
+    def _get_time_stored(internal_data):
+        """ returns the time at which an item was stored """
+        if internal_data:
+            return internal_data.get('time_stored')
+        else:
+            return None
+
+
+    def __setitem__(self, key, data):
+        """ store new `data` with a given `key` """
+        self._set_items([(key, data)])
+
+
+    def _set_items(self, items):
+        """ store many `items`, which is a list of tuples (key, data), while
+        locking the index only once """
+        if self.readonly:
+            raise IOError('Cannot write to readonly storage')
+
+        # the files are written before the index is locked
+        entries = [self._write_item(key, data) for key, data in items]
+
+        with self._lock.acquire():
+            self.refresh_index()
+            replaced = [self._index[entry[0]] for entry in entries
+                        if entry[0] in self._index]
+            self._append_index(entries)
+            self.refresh_index()
+            self._check_compact()
+
+        self._remove_files(replaced)
+        logging.debug('Stored %d items in directory', len(entries))
+
+
+    def __delitem__(self, key):
+        """ delete item with given key """
+        if key not in self:
+            raise KeyError(key)
+        self._del_items([key])
+
+
+    def _del_items(self, keys):
+        """ delete the items with the given `keys` while locking the index only
+        once """
+        if self.readonly:
+            raise IOError('Cannot delete from a readonly storage')
+        keys = list(keys)
+        if not keys:
+            return
+
+        with self._lock.acquire():
+            self.refresh_index()
+            # other processes might have deleted items in the meantime
+            keys = [key for key in keys if key in self._index]
+            names = [self._index[key] for key in keys]
+            self._append_index([[key, None] for key in keys])
+            self.refresh_index()
+            self._check_compact()
+
+        self._remove_files(names)
+        logging.debug('Deleted %d items from directory', len(names))
+
+
+    def _remove_files(self, names):
+        """ removes the files belonging to the items `names` """
+        for name in names:
+            for extension in ('.npy', '.json'):
+                try:
+                    os.remove(self._get_path(name, extension))
+                except OSError:
+                    pass #< file has already been removed
@@ -6,25 +6,73 @@ Created on Nov 12, 2015
 
 from __future__ import division
 
+import contextlib
 import logging
 import itertools
 import os
-import shutil
 import tempfile
+import threading
+import time
+import uuid
 
 import numpy as np
 import h5py
 import json
 
 from .base import StorageBase
+from .keys import json_default
+from .locking import FileLock, KeyFileLock
+
+
+
+def get_chunk_shape(shape, itemsize, chunk_bytes=2**20):
+    """ determines the shape of chunks for storing an array of the given
+    `shape` and `itemsize`, such that each chunk occupies at most `chunk_bytes`
+    bytes. The array is split along its leading axes first, such that slices
+    along the first axis can be read efficiently. """
+    chunks = list(shape)
+    size = itemsize * np.prod(chunks)
+    for axis in xrange(len(chunks)):
+        while size > chunk_bytes and chunks[axis] > 1:
+            chunks[axis] = (chunks[axis] + 1) // 2
+            size = itemsize * np.prod(chunks)
+    return tuple(chunks)
 
 
 
 class StorageHDF5(StorageBase):
-    """ manages a cache that is stored in a hdf5 file """
+    """ manages a cache that is stored in a hdf5 file
+    
+    Each item is stored in a separate dataset in the root group of the file.
+    Additionally, the file contains the dataset `INDEX_NAME`, which maps the
+    keys to the names of the datasets and also stores the keyword arguments and
+    the storage time of each item. Consequently, neither the index nor the
+    secondary index need to be rebuilt from all datasets when the file is
+    opened.
+    
+    The stored index carries the attributes `index_id`, which changes whenever
+    the index is rewritten, and `generation`, which is incremented whenever
+    existing rows are modified. If neither changed, a process only needs to
+    read the rows that other processes appended to the index.
+    
+    The storage can be used by several threads at the same time, since the
+    access to the file is serialized by a lock.
+    """
+    
+    # name and format of the dataset storing the index
+    INDEX_NAME = '__index__'
+    INDEX_VERSION = 3
+    INDEX_DTYPE = np.dtype([('key', h5py.special_dtype(vlen=str)),
+                            ('name', h5py.special_dtype(vlen=str)),
+                            ('kwargs', h5py.special_dtype(vlen=str)),
+                            ('deleted', np.bool),
+                            ('time_stored', np.double)])
 
     def __init__(self, database_file, readonly=False, truncate=False,
-                 temporary=False):
+                 temporary=False, keep_open=False, flush_interval=None,
+                 key_builder=None, compression=None, compression_opts=None,
+                 shuffle=False, chunks=None, repack_threshold=None,
+                 concurrent=False, memmap=False):
         """ initialize the hdf5 database
         
         `database_file` denotes the filename where the database is stored
@@ -33,28 +81,260 @@ class StorageHDF5(StorageBase):
             before usage
         `temporary` indicates whether the database file will be deleted when the
             objects is deleted
+        `keep_open` is a flag determining whether the hdf5 file is kept open
+            between operations. This is equivalent to calling `open` right
+            after initialization.
+        `flush_interval` is the time in seconds after which written data is
+            flushed to disk while the file is kept open. If it is `None`, the
+            data is only flushed when the file is closed.
+        `key_builder` determines how keys are built from the arguments. If the
+            keys stored in the file have been built differently, the index is
+            rebuilt from the arguments stored with each item.
+        `compression` is the filter used to compress the stored arrays, e.g.
+            'gzip' or 'lzf'. Compressed arrays are always stored in chunks.
+        `compression_opts` are options for the compression filter, e.g. the
+            compression level between 0 and 9 for 'gzip'
+        `shuffle` is a flag determining whether the shuffle filter is applied
+            before compression, which often improves the compression ratio
+        `chunks` determines the shape of the chunks in which arrays are
+            stored. It can be a tuple, True to let h5py guess the shape, or
+            'auto' to choose the shape using `get_chunk_shape`.
+        These options can also be set for individual items when calling
+        `store` or `store_many`.
+        `repack_threshold` is the fraction of the file size occupied by deleted
+            items above which the file is automatically repacked after items
+            have been deleted. If it is None, the file is never repacked
+            automatically.
+        `concurrent` is a flag determining whether several processes can use
+            the file at the same time. Each access is then protected by an
+            advisory lock on the file `database_file + '.lock'`, such that
+            writes are serialized, and the file is read in the single writer
+            multiple reader (SWMR) mode. The index is refreshed with the changes
+            of other processes whenever the file is opened. The file can thus
+            not be kept open in this mode. Additionally, the lock file
+            `database_file + '.keys'` is used to prevent several processes
+            from calculating the same item in cached functions.
+        `memmap` is a flag determining whether arrays that are stored
+            contiguously without compression are returned as read-only memory
+            maps of the file instead of being copied into memory. Several
+            processes can then share the same pages of the file.
         """
-        super(StorageHDF5, self).__init__()
+        super(StorageHDF5, self).__init__(key_builder=key_builder)
+        if concurrent and keep_open:
+            raise ValueError('The hdf file cannot be kept open in concurrent '
+                             'mode')
         
         self.readonly = readonly
         self.filename = database_file
         self.temporary = temporary
-                
-        if truncate:
-            h5py.File(self.filename, 'w').close()
+        self.concurrent = concurrent
+        self.memmap = memmap
+        self.flush_interval = flush_interval
+        self.repack_threshold = repack_threshold
+        self.dataset_options = {'compression': compression,
+                                'compression_opts': compression_opts,
+                                'shuffle': shuffle,
+                                'chunks': chunks}
+
+        # handle of the hdf5 file if it is kept open
+        self._db = None
+        self._open_count = 0
+        self._last_flush = time.time()
+        self._thread_lock = threading.RLock()
+        if concurrent:
+            self._lock = FileLock(self.filename + '.lock')
+            self._key_lock = KeyFileLock(self.filename + '.keys')
         else:
-            h5py.File(self.filename, 'a').close()
+            self._lock = None
+            self._key_lock = None
 
         # build the index of the database
         self._index = {}
+        self._index_rows = {}
+        self._index_id = None #< identifier of the index stored in the file
+        self._index_generation = 0 #< number of modifications of the index
+        self._index_length = 0 #< number of rows of the index that were read
+        self._dead_bytes = None #< bytes occupied by deleted datasets
+                
+        if truncate:
+            self._truncate()
+        else:
+            with self._file_lock():
+                self._open_file('a').close()
+
         self.update_index()
         
+        if keep_open:
+            self.open()
+        
         
     def __del__(self):
         """ called before the object is destroyed """
-        if self.temporary:
+        if getattr(self, '_db', None) is not None:
+            self._close_file()
+
+        if getattr(self, 'temporary', False):
             logging.debug('Delete the database file')
             os.remove(self.filename)
+            if self._lock is not None:
+                for path in (self._lock.path, self._key_lock.path):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+
+    def __getstate__(self):
+        """ return the state for pickling, which excludes the thread lock and
+        the open file """
+        state = self.__dict__.copy()
+        del state['_thread_lock']
+        state['_db'] = None
+        state['_open_count'] = 0
+        return state
+
+
+    def __setstate__(self, state):
+        """ restore the storage from the pickled state. Only the original
+        storage deletes a temporary file. """
+        self.__dict__.update(state)
+        self._thread_lock = threading.RLock()
+        self.temporary = False
+
+
+    def __enter__(self):
+        """ keep the hdf5 file open inside a with statement """
+        self.open()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ close the hdf5 file when the with statement is left """
+        self.close()
+
+
+    @property
+    def is_open(self):
+        """ flag indicating whether the hdf5 file is kept open """
+        return self._db is not None
+
+
+    def open(self):
+        """ keep the hdf5 file open until `close` is called. The file is first
+        opened for reading and it is reopened in append mode as soon as data
+        needs to be written. Calls can be nested, such that the file is only
+        closed after `close` has been called as often as `open`.
+        """
+        if self.concurrent:
+            raise ValueError('The hdf file cannot be kept open in concurrent '
+                             'mode')
+        if self._db is None:
+            logging.debug('Open the hdf file')
+            self._db = h5py.File(self.filename, 'r')
+        self._open_count += 1
+
+
+    def close(self):
+        """ close the hdf5 file that was kept open by calling `open` """
+        if self._open_count > 0:
+            self._open_count -= 1
+        if self._open_count == 0 and self._db is not None:
+            self._close_file()
+
+
+    def _close_file(self):
+        """ closes the file handle that is kept open """
+        logging.debug('Close the hdf file')
+        self._db.close()
+        self._db = None
+
+
+    def flush(self):
+        """ write all pending data to disk if the hdf5 file is kept open """
+        if self._db is not None and self._db.mode != 'r':
+            self._db.flush()
+        self._last_flush = time.time()
+
+
+    @contextlib.contextmanager
+    def _file_lock(self, shared=False):
+        """ context manager holding the lock of the hdf5 file in concurrent
+        mode. The lock is exclusive unless `shared` is True. """
+        if self._lock is None:
+            yield
+        else:
+            with self._lock.acquire(shared=shared):
+                yield
+
+
+    def _open_file(self, mode):
+        """ opens the hdf5 file with the given `mode`. In concurrent mode, the
+        latest file format is used and the file is read in SWMR mode. """
+        if not self.concurrent:
+            return h5py.File(self.filename, mode)
+        elif mode == 'r':
+            return h5py.File(self.filename, 'r', libver='latest', swmr=True)
+        else:
+            return h5py.File(self.filename, mode, libver='latest')
+
+
+    @contextlib.contextmanager
+    def _database(self, mode='r', refresh=True):
+        """ context manager returning the hdf5 file opened with at least the
+        permissions given by `mode`. If the file is kept open, the existing
+        handle is returned and it is only reopened when data needs to be written
+        to a file that has been opened for reading. In concurrent mode, the file
+        is locked while it is open and the index is refreshed with the changes
+        of other processes, unless `refresh` is False. """
+        with self._thread_lock:
+            if self.concurrent:
+                # open the file while no other process is writing to it
+                with self._file_lock(shared=(mode == 'r')):
+                    with self._open_file(mode) as db:
+                        if refresh and not self._refresh_index(db):
+                            self._rebuild_index(db)
+                        yield db
+    
+            elif self._db is None:
+                # open the file just for this operation
+                with h5py.File(self.filename, mode) as db:
+                    yield db
+    
+            else:
+                # use the file handle that is kept open
+                if mode != 'r' and self._db.mode == 'r':
+                    logging.debug('Reopen the hdf file in append mode')
+                    self._db.close()
+                    self._db = h5py.File(self.filename, mode)
+    
+                yield self._db
+    
+                if (mode != 'r' and self.flush_interval is not None and
+                        time.time() - self._last_flush >= self.flush_interval):
+                    self.flush()
+
+
+    def key_lock(self, key):
+        """ context manager that prevents other processes from calculating
+        the item with the given `key` at the same time in concurrent mode """
+        if self._key_lock is None:
+            return super(StorageHDF5, self).key_lock(key)
+        else:
+            return self._key_lock.acquire(key)
+
+
+    def _truncate(self):
+        """ removes all data from the hdf5 file and creates an empty index """
+        if self._db is not None:
+            self._db.close()
+        with self._file_lock():
+            # create a new file, such that memory maps of the old file remain
+            # valid
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+            with self._open_file('w') as db:
+                self._index_rows = {}
+                self._append_index(db, [])
+        if self._db is not None:
+            self._db = h5py.File(self.filename, 'r')
           
 
     def clear(self, time_max=None, kwargs=None):
@@ -66,154 +346,579 @@ class StorageHDF5(StorageBase):
 
         if time_max is None and kwargs is None:
             # the database will be emptied
-            h5py.File(self.filename, 'w').close()
-            self._index = {}
+            with self._thread_lock:
+                self._truncate()
+                self._index = {}
+                self._index_rows = {}
+                self._dead_bytes = 0
+                self._reset_secondary_index()
             
         else:
             # potentially only a part of the database will be affected 
             super(StorageHDF5, self).clear(time_max, kwargs)
         
         
+    def get_dead_space(self):
+        """ returns the number of bytes occupied by deleted datasets, which
+        can be reclaimed by calling `repack` """
+        if self._dead_bytes is None:
+            names = set(self._index_rows) - set(self._index.itervalues())
+            with self._database('r') as db:
+                self._dead_bytes = sum(db[name].id.get_storage_size()
+                                       for name in names)
+        return self._dead_bytes
+    
+    
+    def get_dead_fraction(self):
+        """ returns the fraction of the file size occupied by deleted
+        datasets """
+        file_size = os.stat(self.filename).st_size
+        if file_size == 0:
+            return 0
+        return min(self.get_dead_space() / file_size, 1)
+        
+        
+    def _check_repack(self):
+        """ repacks the file if the deleted datasets occupy too much space """
+        if (self.repack_threshold is not None and
+                self.get_dead_fraction() > self.repack_threshold):
+            logging.info('Repack the hdf file since deleted items occupy '
+                         '%d bytes', self.get_dead_space())
+            self.repack()
+        
+        
     def repack(self):
-        """ rewrite the hdf5 file to make sure deleted data is removed """
+        """ rewrite the hdf5 file to make sure deleted data is removed. The
+        datasets are copied directly, such that their data and attributes do
+        not need to be decoded. """
         if self.readonly:
             raise IOError('Cannot repack readonly database')
         
-        # generate temporary file and associated storage
-        file_tmp = tempfile.NamedTemporaryFile(suffix='.hdf5', delete=False)
-        storage_tmp = StorageHDF5(file_tmp.name, truncate=True)
+        # other processes must not use the file while it is being replaced
+        with self._thread_lock, self._file_lock():
+            self._repack()
+            
+            
+    def _repack(self):
+        """ rewrite the hdf5 file while the file lock is held """
+        # generate temporary file in the same directory
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        file_tmp = tempfile.NamedTemporaryFile(suffix='.hdf5', dir=dirname,
+                                               delete=False)
+        file_tmp.close()
 
         logging.debug('Created temporary database at `%s`', file_tmp.name)
         
-        # copy all data to temporary storage
-        for value in self.itervalues():
-            storage_tmp.store(*value)
+        # copy all items and the associated index to the temporary file
+        entries = []
+        with self._database('r') as db:
+            with h5py.File(file_tmp.name, 'w') as db_tmp:
+                for key, name in self._index.iteritems():
+                    db.copy(db[name], db_tmp, name=name)
+                    kwargs_key, time_stored = self._secondary_entries[key]
+                    entries.append((key, name, kwargs_key, False,
+                                    time_stored))
+                self._append_index(db_tmp, entries)
 
         logging.debug('Copied data to temporary database')
             
-        # copy temporary file to location of this file
-        os.remove(self.filename)
-        shutil.move(file_tmp.name, self.filename)
+        # replace this file by the temporary file in a single step
+        is_open = self._db is not None
+        if is_open:
+            self._close_file()
+        os.rename(file_tmp.name, self.filename)
+        if is_open:
+            self._db = h5py.File(self.filename, 'r')
         
-        # copy index of temporary storage to current object
-        self._index = storage_tmp._index
+        # read the index of the new file
+        self.update_index()
+        self._dead_bytes = 0
 
         logging.debug('Substituted current database by the temporary one')
         
           
     def update_index(self):
-        """ update the index from the database """
+        """ update the index from the database. The index stored in the hdf
+        file is used if it is present and up to date. Otherwise, the index is
+        rebuilt from all datasets. """
         logging.debug('Start reading the index from the hdf file')
-        with h5py.File(self.filename, 'r') as db:
-            self._index = {}
-            for name, dataset in db.iteritems():
-                if dataset.attrs.get('deleted', False):
-                    continue
-                args = json.loads(dataset.attrs['args'])
-                kwargs = json.loads(dataset.attrs['kwargs'])
-                key = self.get_key(args, kwargs)
-                if key in self._index:
-                    logging.warn('Database contains key `%s` more than once.',
-                                 key)
+        with self._database('r', refresh=False) as db:
+            index_loaded = self._read_index(db)
+            
+        if index_loaded:
+            logging.debug('Found %d items in the hdf file', len(self._index))
+        else:
+            self.rebuild_index()
+            
+            
+    def _read_index(self, db):
+        """ reads the index stored in the hdf file `db`. Returns False if the
+        stored index is missing or stale """
+        if self.INDEX_NAME not in db:
+            logging.debug('The hdf file does not contain an index')
+            return False
+        
+        dataset = db[self.INDEX_NAME]
+        if dataset.attrs.get('version') != self.INDEX_VERSION:
+            logging.info('The index stored in the hdf file has a different '
+                         'version')
+            return False
+        if dataset.attrs.get('key_format', 'json') != self.key_builder.name:
+            logging.info('The keys stored in the hdf file have a different '
+                         'format')
+            return False
+        
+        # each dataset has exactly one row in the stored index
+        if len(dataset) != len(db) - 1:
+            logging.info('The index stored in the hdf file is stale')
+            return False
+        
+        self._index = {}
+        self._index_rows = {}
+        self._reset_secondary_index()
+        self._add_index_rows(dataset[()], 0)
+        self._index_id = dataset.attrs.get('index_id')
+        self._index_generation = dataset.attrs.get('generation', 0)
+        
+        return True
+    
+    
+    def _add_index_rows(self, rows, row0):
+        """ adds the `rows` read from the stored index, starting at row
+        `row0`, to the index """
+        for row, entry in enumerate(rows, row0):
+            key, name = entry['key'], entry['name']
+            self._index_rows[name] = row
+            if not entry['deleted']:
                 self._index[key] = name
-        logging.debug('Found %d items in the hdf file', len(self))
+                self._add_to_secondary_index(key, None, entry['time_stored'],
+                                             kwargs_key=entry['kwargs'])
+        self._index_length = row0 + len(rows)
+    
+    
+    def _refresh_index(self, db):
+        """ updates the index with the changes that other processes made to
+        the hdf file `db`. If rows have only been appended to the stored index,
+        only these rows are read. Returns False if the stored index is missing
+        or stale. """
+        dataset = db.get(self.INDEX_NAME)
+        if (dataset is None or self._index_id is None or
+                dataset.attrs.get('index_id') != self._index_id or
+                dataset.attrs.get('generation', 0) != self._index_generation or
+                len(dataset) < self._index_length):
+            # the stored index has been rewritten or modified
+            logging.debug('Read the full index from the hdf file')
+            self._dead_bytes = None
+            return self._read_index(db)
+        
+        row0 = self._index_length
+        if len(dataset) > row0:
+            logging.debug('Read %d new rows of the index from the hdf file',
+                          len(dataset) - row0)
+            self._add_index_rows(dataset[row0:], row0)
+        return True
+            
+            
+    def rebuild_index(self):
+        """ rebuild the index by reading all datasets from the hdf file and
+        store the index in the file, unless the database is readonly """
+        with self._database('r' if self.readonly else 'a',
+                            refresh=False) as db:
+            self._rebuild_index(db)
+            
+            
+    def _rebuild_index(self, db):
+        """ rebuild the index by reading all datasets from the hdf file `db`
+        and store the index in the file if it has been opened for writing """
+        logging.info('Rebuild the index from all datasets in the hdf file')
+        entries = []
+        self._index = {}
+        self._reset_secondary_index()
+        for name, dataset in db.iteritems():
+            if name == self.INDEX_NAME:
+                continue
+            args, kwargs, internal_data = self._retrieve_metadata(dataset)
+            if dataset.attrs.get('key_format') == self.key_builder.name:
+                # use the stored keys since arrays in the arguments are not
+                # restored from the json attributes
+                key = dataset.attrs['key']
+                kwargs_key = dataset.attrs['kwargs_key']
+            else:
+                key = self.get_key(args, kwargs)
+                kwargs_key = self.get_kwargs_key(kwargs)
+            time_stored = self._get_time_stored(internal_data)
+            deleted = dataset.attrs.get('deleted', False)
+            entries.append((key, name, kwargs_key, deleted, time_stored))
+            
+            if deleted:
+                continue
+            if key in self._index:
+                logging.warn('Database contains key `%s` more than once.',
+                             key)
+            self._index[key] = name
+            self._add_to_secondary_index(key, kwargs, time_stored,
+                                         kwargs_key=kwargs_key)
+        logging.debug('Found %d items in the hdf file', len(self._index))
+        self._dead_bytes = None
+                
+        if db.mode == 'r':
+            self._index_rows = {entry[1]: row
+                                for row, entry in enumerate(entries)}
+            self._index_id = None #< there is no index stored in the file
+        else:
+            if self.INDEX_NAME in db:
+                del db[self.INDEX_NAME]
+            self._index_rows = {}
+            self._append_index(db, entries)
+            
+            
+    @staticmethod
+    def _get_time_stored(internal_data):
+        """ returns the time at which an item was stored """
+        if internal_data:
+            return internal_data.get('time_stored', np.nan)
+        else:
+            return np.nan
+            
+            
+    def _append_index(self, db, entries):
+        """ appends `entries`, which are tuples (key, name, kwargs_key,
+        deleted, time_stored), to the index stored in the hdf file `db` """
+        if self.INDEX_NAME in db:
+            dataset = db[self.INDEX_NAME]
+        else:
+            dataset = db.create_dataset(self.INDEX_NAME, shape=(0,),
+                                        dtype=self.INDEX_DTYPE,
+                                        maxshape=(None,), chunks=(256,))
+            dataset.attrs['version'] = self.INDEX_VERSION
+            dataset.attrs['key_format'] = self.key_builder.name
+            dataset.attrs['index_id'] = uuid.uuid4().hex
+            dataset.attrs['generation'] = 0
+            self._index_id = dataset.attrs['index_id']
+            self._index_generation = 0
+            
+        row0 = len(dataset)
+        self._index_length = row0 + len(entries)
+        if not entries:
+            return
+            
+        dataset.resize((row0 + len(entries),))
+        dataset[row0:] = np.array(entries, dtype=self.INDEX_DTYPE)
+        for row, entry in enumerate(entries, row0):
+            self._index_rows[entry[1]] = row
+        
+        
+    def refresh_index(self):
+        """ reads the changes that other processes made to the index. This
+        only has an effect in concurrent mode, where it happens automatically
+        whenever the file is accessed. """
+        if self.concurrent:
+            with self._database('r'):
+                pass
+            
+            
+    def _keys_with_kwargs(self, kwargs):
+        """ returns the keys of all items stored with the given `kwargs` """
+        self.refresh_index()
+        return super(StorageHDF5, self)._keys_with_kwargs(kwargs)
+    
+    
+    def _keys_stored_before(self, time_max):
+        """ returns the keys of all items stored before `time_max` """
+        self.refresh_index()
+        return super(StorageHDF5, self)._keys_stored_before(time_max)
+    
+    
+    def _all_keys(self):
+        """ returns the keys of all items in the storage """
+        self.refresh_index()
+        return super(StorageHDF5, self)._all_keys()
         
         
     def __len__(self):
         """ return length of the storage """
+        self.refresh_index()
         return len(self._index)
+    
+    
+    def __contains__(self, key):
+        """ determines whether an item with the given `key` is stored """
+        self.refresh_index()
+        return key in self._index
 
 
-    def _retrieve_dataset(self, dataset, with_internal=True):
-        """ returns the (result, args, kwargs) from a hdf5 dataset """
+    def _retrieve_dataset(self, dataset, with_internal=True, selection=None):
+        """ returns the (result, args, kwargs) from a hdf5 dataset. If
+        `selection` is given, only this part of the array is read. """
         
         if dataset.attrs.get('deleted', False):
             raise KeyError('Dataset `%s` has been deleted' % dataset.name)
         
-        data_array = dataset[()]
+        data_array = None
+        if self.memmap:
+            data_array = self._map_dataset(dataset)
+        if data_array is None:
+            data_array = dataset
+        if selection is None:
+            data_array = data_array[()]
+        else:
+            data_array = data_array[selection]
+        args, kwargs, internal_data = self._retrieve_metadata(dataset)
+        
+        if with_internal:
+            return data_array, args, kwargs, internal_data
+        else: 
+            return data_array, args, kwargs
+        
+        
+    def _map_dataset(self, dataset):
+        """ returns a read-only memory map of the array stored in `dataset`
+        or None if the array is not stored contiguously in the file """
+        dcpl = dataset.id.get_create_plist()
+        if (dcpl.get_layout() != h5py.h5d.CONTIGUOUS or dcpl.get_nfilters() > 0
+                or dcpl.get_external_count() > 0 or dataset.ndim == 0
+                or dataset.dtype.hasobject or dataset.dtype.kind not in 'biufc'):
+            return None
+        offset = dataset.id.get_offset()
+        if offset is None:
+            return None #< storage of the dataset has not been allocated
+        
+        if dataset.file.mode != 'r':
+            # make sure that the data has been written to the file
+            dataset.file.flush()
+        return np.memmap(dataset.file.filename, mode='r', dtype=dataset.dtype,
+                         shape=dataset.shape, offset=offset)
+    
+    
+    def _retrieve_metadata(self, dataset):
+        """ returns the (args, kwargs, internal_data) from a hdf5 dataset
+        without reading the stored array """
         args = json.loads(dataset.attrs['args'])
         if args is None:
             args = tuple()
         kwargs = json.loads(dataset.attrs['kwargs'])
         if kwargs is None:
             kwargs = {}
-        
-        if with_internal:
-            internal_data = json.loads(dataset.attrs['internal_data'])
-            return data_array, args, kwargs, internal_data
-        else: 
-            return data_array, args, kwargs
+        internal_data = json.loads(dataset.attrs['internal_data'])
+        return args, kwargs, internal_data
+    
+    
+    def _iter_metadata(self, keys):
+        """ iterates over the metadata of many `keys` by only reading the
+        attributes of the datasets """
+        with self._database('r') as db:
+            for key in keys:
+                try:
+                    name = self._index[key]
+                except KeyError:
+                    yield None
+                else:
+                    yield self._retrieve_metadata(db[name])
 
 
     def itervalues(self):
         """ iterates through all values """
-        with h5py.File(self.filename, 'r') as db:
+        with self._database('r') as db:
             for name in self._index.itervalues():
                 yield self._retrieve_dataset(db[name])
                
                 
     def iteritems(self):
         """ iterates through all keys and values """
-        with h5py.File(self.filename, 'r') as db:
+        with self._database('r') as db:
             for key, name in self._index.iteritems():
                 yield key, self._retrieve_dataset(db[name])
                
                 
     def __getitem__(self, key):
         """ retrieve data with given `key` from hdf5 file """
-        name = self._index[key]
-        
-        with h5py.File(self.filename, 'r') as db:
+        with self._database('r') as db:
+            name = self._index[key]
             result = self._retrieve_dataset(db[name])
             
         logging.debug('Loaded item `%s` from hdf file', name)
         
         return result
-
-
-    def __setitem__(self, key, data):
-        """ store new `data` in the hdf5 file with a given `key` """
-        if self.readonly:
-            raise IOError('Cannot write to readonly database')
+    
+    
+    def _get_item_selection(self, key, selection):
+        """ retrieve the part `selection` of the data with given `key` by only
+        reading this part from the hdf5 file """
+        with self._database('r') as db:
+            name = self._index[key]
+            result = self._retrieve_dataset(db[name], selection=selection)
+            
+        logging.debug('Loaded part of item `%s` from hdf file', name)
         
+        return result
+    
+    
+    def _iter_items(self, keys):
+        """ iterates over the data for many `keys` while opening the hdf5 file
+        only once """
+        with self._database('r') as db:
+            for key in keys:
+                try:
+                    name = self._index[key]
+                except KeyError:
+                    yield None
+                else:
+                    yield self._retrieve_dataset(db[name])
+    
+    
+    def _get_dataset_options(self, data_array, options=None):
+        """ returns the options for creating a dataset holding `data_array`.
+        The default options of the storage are updated with `options`. """
+        result = self.dataset_options.copy()
+        if options:
+            unknown = set(options) - set(result)
+            if unknown:
+                raise ValueError('Unknown dataset options: %s'
+                                 % ', '.join(sorted(unknown)))
+            result.update(options)
+            
+        if data_array.ndim == 0 or data_array.size == 0:
+            # scalars and empty arrays cannot be stored in chunks
+            return {}
+        
+        if result['chunks'] == 'auto':
+            result['chunks'] = get_chunk_shape(data_array.shape,
+                                               data_array.dtype.itemsize)
+        
+        return {k: v for k, v in result.iteritems()
+                if v is not None and v is not False}
+    
+    
+    def _create_dataset(self, db, key, data, options=None):
+        """ stores `data` in a new dataset in the hdf file `db` and returns the
+        associated entry for the index. `options` can modify the default
+        options for creating the dataset. """
         data_array, args, kwargs, internal_data = data
+        data_array = np.asarray(data_array)
         
         # determine the name of the key 
         name0 = str(hash(key))
         name = name0
 
         # make sure that the name is unique
-        with h5py.File(self.filename, 'a') as db:
-            for i in itertools.count():
-                if name in db:
-                    name = '%s_%03d' % (name0, i)
-                else:
-                    break
-                
-            # store the result
-            dataset = db.create_dataset(name, data=np.asarray(data_array))
-            dataset.attrs['args'] = json.dumps(args)
-            dataset.attrs['kwargs'] = json.dumps(kwargs)
-            dataset.attrs['internal_data'] = json.dumps(internal_data)
+        for i in itertools.count():
+            if name in db:
+                name = '%s_%03d' % (name0, i)
+            else:
+                break
+            
+        # store the result
+        dataset = db.create_dataset(
+                    name, data=data_array,
+                    **self._get_dataset_options(data_array, options))
+        dataset.attrs['args'] = json.dumps(args, default=json_default)
+        dataset.attrs['kwargs'] = json.dumps(kwargs, default=json_default)
+        dataset.attrs['internal_data'] = json.dumps(internal_data,
+                                                    default=json_default)
+        kwargs_key = self.get_kwargs_key(kwargs)
+        dataset.attrs['key'] = key
+        dataset.attrs['kwargs_key'] = kwargs_key
+        dataset.attrs['key_format'] = self.key_builder.name
+        
+        return (key, name, kwargs_key, False,
+                self._get_time_stored(internal_data))
+
+
+    def __setitem__(self, key, data):
+        """ store new `data` in the hdf5 file with a given `key` """
+        self._set_items([(key, data)])
+        
+        
+    def store(self, result, args=None, kwargs=None, internal_data=None,
+              **options):
+        """ store data based on given arguments. Additional keyword arguments
+        set the options for storing the array, see `__init__`. """
+        key, value = self._prepare_item(result, args, kwargs, internal_data)
+        self._set_items([(key, value)], options)
+        
         
-        # add the dataset to the index
-        self._index[key] = name
+    def store_many(self, results, args_list=None, kwargs_list=None,
+                   internal_data=None, **options):
+        """ store many results at once. Additional keyword arguments set the
+        options for storing the arrays, see `__init__`. """
+        items = self._prepare_items(results, args_list, kwargs_list,
+                                    internal_data)
+        self._set_items(items, options)
         
-        logging.debug('Stored item `%s` to hdf file', name)
+        
+    def _set_items(self, items, options=None):
+        """ store many `items`, which is a list of tuples (key, data), while
+        opening the hdf5 file and extending the index only once. `options`
+        can modify the default options for creating the datasets. """
+        if self.readonly:
+            raise IOError('Cannot write to readonly database')
+        
+        with self._database('a') as db:
+            # items that are overwritten are marked as deleted
+            for key, _ in items:
+                if key in self._index:
+                    self._mark_deleted(db, self._index.pop(key))
+                    self._remove_from_secondary_index(key)
+            
+            entries = [self._create_dataset(db, key, data, options)
+                       for key, data in items]
+        
+            # add the datasets to the index
+            self._append_index(db, entries)
+            
+            for key, name, kwargs_key, _, time_stored in entries:
+                self._index[key] = name
+                self._add_to_secondary_index(key, None, time_stored,
+                                             kwargs_key=kwargs_key)
+                logging.debug('Stored item `%s` to hdf file', name)
 
 
     def __delitem__(self, key):
         """ delete item with given key """ 
+        if key not in self:
+            raise KeyError(key)
+        self._del_items([key])
+        
+        
+    def _del_items(self, keys):
+        """ delete the items with the given `keys` while opening the hdf5 file
+        only once. The file is repacked afterwards if the deleted datasets
+        occupy too much space. """
         if self.readonly:
             raise IOError('Cannot delete from a readonly database')
+        keys = list(keys)
+        if not keys:
+            return
 
-        name = self._index[key]
-        
-        with h5py.File(self.filename, 'a') as db:
-            db[name].attrs['deleted'] = True
-
-        del self._index[key]
+        with self._database('a') as db:
+            # other processes might have deleted items in the meantime
+            keys = [key for key in keys if key in self._index]
+            names = [self._index[key] for key in keys]
+            for name in names:
+                self._mark_deleted(db, name)
 
-        logging.debug('Deleted item `%s` from hdf file', name)
+            for key, name in zip(keys, names):
+                del self._index[key]
+                self._remove_from_secondary_index(key)
+                logging.debug('Deleted item `%s` from hdf file', name)
+            
+        self._check_repack()
+            
+            
+    def _mark_deleted(self, db, name):
+        """ marks the dataset `name` in the hdf file `db` as deleted """
+        dataset = db[name]
+        dataset.attrs['deleted'] = True
+        if self._dead_bytes is not None:
+            self._dead_bytes += dataset.id.get_storage_size()
+        
+        # mark the item as deleted in the index
+        dataset = db[self.INDEX_NAME]
+        row = self._index_rows[name]
+        entry = dataset[row]
+        entry['deleted'] = True
+        dataset[row] = entry
+        self._index_generation = dataset.attrs.get('generation', 0) + 1
+        dataset.attrs['generation'] = self._index_generation
 
 
@@ -0,0 +1,154 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+
+Functions that turn the arguments of a function call into a key under which
+the result is stored. A key builder is a callable that receives the tuple of
+all arguments and returns a string. Its attribute `name` identifies the format
+of the keys, such that persistent storages can detect keys that have been
+built differently.
+'''
+
+from __future__ import division
+
+import hashlib
+import json
+from json.encoder import encode_basestring_ascii
+
+import numpy as np
+
+
+
+class KeyBuilderJSON(object):
+    """ builds keys by serializing the arguments using the json module """
+
+    name = 'json'
+
+    def __call__(self, args):
+        """ returns the key for the arguments `args` """
+        return json.dumps(args, sort_keys=True)
+
+
+
+class KeyBuilder(object):
+    """ builds keys by serializing the arguments to the same string that is
+    returned by `json.dumps(args, sort_keys=True)`. This is considerably
+    faster than using the json module, since the function to serialize an
+    object is looked up by its type and the result of the lookup is cached.
+    Additionally, numpy scalars are supported and numpy arrays are represented
+    by a hash of their content.
+    """
+
+    name = 'json'
+
+
+    def __init__(self):
+        """ initialize the key builder """
+        self._serializers = {
+            type(None): lambda obj: 'null',
+            bool: lambda obj: 'true' if obj else 'false',
+            int: str,
+            long: str,
+            float: self._serialize_float,
+            str: encode_basestring_ascii,
+            unicode: encode_basestring_ascii,
+            list: self._serialize_list,
+            tuple: self._serialize_list,
+            dict: self._serialize_dict,
+            np.ndarray: self._serialize_array,
+        }
+
+
+    def __reduce__(self):
+        """ pickle the key builder without the cached serializers, which are
+        created again when it is unpickled """
+        return (self.__class__, ())
+
+
+    def __call__(self, args):
+        """ returns the key for the arguments `args` """
+        return self.serialize(args)
+
+
+    def serialize(self, obj):
+        """ returns the string representing `obj` """
+        try:
+            serializer = self._serializers[type(obj)]
+        except KeyError:
+            serializer = self._get_serializer(type(obj))
+        return serializer(obj)
+
+
+    def _get_serializer(self, obj_type):
+        """ determines the function serializing objects of type `obj_type`
+        and caches it for later use """
+        if issubclass(obj_type, (np.generic)):
+            serializer = self._serialize_numpy_scalar
+        else:
+            for base_type in (bool, int, long, float, basestring, list, tuple,
+                              dict, np.ndarray):
+                if issubclass(obj_type, base_type):
+                    serializer = self._serializers[base_type]
+                    break
+            else:
+                raise TypeError('Cannot build key from object of type `%s`'
+                                % obj_type.__name__)
+
+        self._serializers[obj_type] = serializer
+        return serializer
+
+
+    @staticmethod
+    def _serialize_float(obj):
+        """ serializes a float """
+        if obj != obj:
+            return 'NaN'
+        elif obj == float('inf'):
+            return 'Infinity'
+        elif obj == -float('inf'):
+            return '-Infinity'
+        else:
+            return float.__repr__(obj)
+
+
+    def _serialize_list(self, obj):
+        """ serializes a list or a tuple """
+        return '[' + ', '.join([self.serialize(item) for item in obj]) + ']'
+
+
+    def _serialize_dict(self, obj):
+        """ serializes a dictionary with sorted keys """
+        items = []
+        for key, value in sorted(obj.items(), key=lambda kv: kv[0]):
+            if not isinstance(key, basestring):
+                # keys are always represented as strings
+                key = self.serialize(key).strip('"')
+            items.append(encode_basestring_ascii(key) + ': ' +
+                         self.serialize(value))
+        return '{' + ', '.join(items) + '}'
+
+
+    def _serialize_numpy_scalar(self, obj):
+        """ serializes a numpy scalar by converting it to a python object """
+        return self.serialize(obj.item())
+
+
+    def _serialize_array(self, arr):
+        """ serializes a numpy array using a hash of its content """
+        if arr.dtype.hasobject:
+            return self.serialize(arr.tolist())
+        data = np.ascontiguousarray(arr).view(np.uint8)
+        return ('{"__ndarray__": "%s", "dtype": "%s", "shape": %s}'
+                % (hashlib.sha1(data).hexdigest(), arr.dtype.str,
+                   self.serialize(arr.shape)))
+
+
+
+def json_default(obj):
+    """ converts numpy objects, which are not supported by the json module,
+    to python objects. This function can be used as the `default` argument of
+    `json.dumps` """
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError('%r is not JSON serializable' % obj)
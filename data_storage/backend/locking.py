@@ -0,0 +1,171 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+
+Advisory file locks that coordinate the access of several processes to the
+same storage.
+'''
+
+from __future__ import division
+
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+
+
+
+class FileLock(object):
+    """ advisory lock based on `flock` on the file `path`. The lock can be
+    acquired in shared mode, e.g., for reading, or in exclusive mode, e.g., for
+    writing. The lock can be acquired repeatedly by the same thread and
+    threads of the same process are serialized. """
+
+
+    def __init__(self, path):
+        """ initialize the lock using the lock file `path` """
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._fd = None
+        self._count = 0
+        self._exclusive = False
+
+
+    def __getstate__(self):
+        """ return the state for pickling, which excludes the held lock """
+        return {'path': self.path}
+
+
+    def __setstate__(self, state):
+        """ restore the lock from the pickled state """
+        self.__init__(state['path'])
+
+
+    @property
+    def is_locked(self):
+        """ flag indicating whether this object holds the lock """
+        return self._count > 0
+
+
+    @contextlib.contextmanager
+    def acquire(self, shared=False):
+        """ context manager holding the lock. If `shared` is True, other
+        processes can also hold the lock in shared mode at the same time. A
+        shared lock is converted to an exclusive lock if an exclusive lock is
+        requested while the shared lock is held. """
+        with self._thread_lock:
+            if self._count == 0:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+                fcntl.flock(self._fd, fcntl.LOCK_SH if shared else
+                                      fcntl.LOCK_EX)
+                self._exclusive = not shared
+
+            elif not shared and not self._exclusive:
+                logging.debug('Convert shared lock on `%s` to exclusive lock',
+                              self.path)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                self._exclusive = True
+
+            self._count += 1
+            try:
+                yield
+            finally:
+                self._count -= 1
+                if self._count == 0:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                    os.close(self._fd)
+                    self._fd = None
+
+
+
+class KeyLocks(object):
+    """ locks for individual keys, which serialize the threads of a process.
+    The lock of a key only exists while it is used. """
+
+
+    def __init__(self):
+        """ initialize the locks """
+        self._lock = threading.Lock()
+        self._locks = {} #< key => [lock, number of threads using the lock]
+
+
+    @contextlib.contextmanager
+    def acquire(self, key):
+        """ context manager holding the lock of `key` """
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+
+
+class KeyFileLock(object):
+    """ advisory locks for individual keys, which serialize processes. Each
+    key is mapped to one of `num_stripes` bytes of the file `path`, which is
+    locked using `lockf`. Keys sharing the same byte are thus serialized, too.
+    Threads of the same process are serialized by additional locks. """
+
+
+    def __init__(self, path, num_stripes=1024):
+        """ initialize the locks using the lock file `path` """
+        self.path = path
+        self.num_stripes = num_stripes
+        self._init_lock = threading.Lock() #< lock for opening the lock file
+        self._pid = None
+
+
+    def __getstate__(self):
+        """ return the state for pickling, which excludes the held locks """
+        return {'path': self.path, 'num_stripes': self.num_stripes}
+
+
+    def __setstate__(self, state):
+        """ restore the locks from the pickled state """
+        self.__init__(**state)
+
+
+    def _init_process(self):
+        """ opens the lock file in the current process. Locks acquired using
+        `lockf` are not inherited by forked processes. Threads that use the
+        locks for the first time at the same time open the file only once. """
+        with self._init_lock:
+            if self._pid == os.getpid():
+                return #< another thread opened the file in the meantime
+            if self._pid is not None:
+                os.close(self._fd) #< the descriptor of the parent process
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+            self._thread_locks = [threading.RLock()
+                                  for _ in xrange(self.num_stripes)]
+            self._counts = [0] * self.num_stripes
+            self._pid = os.getpid() #< marks the initialization as complete
+
+
+    @contextlib.contextmanager
+    def acquire(self, key):
+        """ context manager holding the lock of `key` """
+        if self._pid != os.getpid():
+            self._init_process()
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        stripe = int(hashlib.sha1(key).hexdigest()[:8], 16) % self.num_stripes
+
+        with self._thread_locks[stripe]:
+            if self._counts[stripe] == 0:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            self._counts[stripe] += 1
+            try:
+                yield
+            finally:
+                self._counts[stripe] -= 1
+                if self._counts[stripe] == 0:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
@@ -6,10 +6,297 @@ Created on Nov 12, 2015
 
 from __future__ import division
 
+import collections
+import logging
+import threading
+import time
+
+import numpy as np
+
 from .base import StorageBase
 
 
 
 class StorageMemory(StorageBase, dict):
-    """ manages a cache that stores data in a dictionary """
-    pass
+    """ manages a cache that stores data in a dictionary. The storage can be
+    used by several threads at the same time. """
+    
+    def __init__(self, *args, **kwargs):
+        """ initialize the storage """
+        super(StorageMemory, self).__init__(*args, **kwargs)
+        self._lock = threading.RLock() #< lock for modifying the storage
+        
+        
+    def __reduce__(self):
+        """ pickle the storage without the lock. The items are part of the
+        state, such that they are only restored after the attributes """
+        attributes = self.__dict__.copy()
+        del attributes['_lock']
+        return (self.__class__, (), (attributes, dict(self)))
+    
+    
+    def __setstate__(self, state):
+        """ restore the storage from the pickled state """
+        attributes, items = state
+        self.__dict__.update(attributes)
+        self._lock = threading.RLock()
+        dict.update(self, items) #< the index is part of the attributes
+    
+    
+    def __setitem__(self, key, data):
+        """ store `data` with a given `key` """
+        with self._lock:
+            super(StorageMemory, self).__setitem__(key, data)
+            self._add_to_secondary_index(key, data[2],
+                                         data[3].get('time_stored'))
+        
+        
+    def __delitem__(self, key):
+        """ delete item with given key """
+        with self._lock:
+            super(StorageMemory, self).__delitem__(key)
+            self._remove_from_secondary_index(key)
+        
+        
+        
+class _EvictionLRU(object):
+    """ eviction policy removing the least recently used item """
+    
+    def __init__(self):
+        self._keys = collections.OrderedDict()
+        
+    def add(self, key):
+        """ register a new item """
+        self._keys[key] = None
+        
+    def touch(self, key):
+        """ register an access to an item """
+        del self._keys[key]
+        self._keys[key] = None
+        
+    def remove(self, key):
+        """ unregister an item """
+        del self._keys[key]
+        
+    def victim(self):
+        """ returns the key of the item that should be evicted next """
+        return next(iter(self._keys))
+        
+        
+        
+class _EvictionTTL(_EvictionLRU):
+    """ eviction policy removing the item that was stored first """
+    
+    def touch(self, key):
+        """ accessing items does not change their order """
+        pass
+        
+        
+        
+class _EvictionLFU(object):
+    """ eviction policy removing the least frequently used item. Items that
+    have been used equally often are evicted in the order they were used. The
+    buckets of the access counts are linked in increasing order, such that all
+    operations take constant time """
+    
+    def __init__(self):
+        self._counts = {} #< key => number of accesses
+        self._buckets = {} #< number of accesses => ordered keys
+        self._links = {} #< number of accesses => [smaller, larger count]
+        self._min_count = None #< first bucket of the linked buckets
+        
+    def _insert_bucket(self, count, previous):
+        """ insert an empty bucket for `count` after the bucket `previous`,
+        which is None for inserting the first bucket """
+        if previous is None:
+            following, self._min_count = self._min_count, count
+        else:
+            following = self._links[previous][1]
+            self._links[previous][1] = count
+        if following is not None:
+            self._links[following][0] = count
+        self._links[count] = [previous, following]
+        self._buckets[count] = collections.OrderedDict()
+        
+    def _remove_key(self, key, count):
+        """ remove `key` from the bucket of `count` and unlink the bucket if
+        it became empty """
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            previous, following = self._links.pop(count)
+            if previous is None:
+                self._min_count = following
+            else:
+                self._links[previous][1] = following
+            if following is not None:
+                self._links[following][0] = previous
+        
+    def add(self, key):
+        """ register a new item """
+        if 1 not in self._buckets:
+            self._insert_bucket(1, None)
+        self._counts[key] = 1
+        self._buckets[1][key] = None
+        
+    def touch(self, key):
+        """ register an access to an item """
+        count = self._counts[key]
+        if count + 1 not in self._buckets:
+            self._insert_bucket(count + 1, count)
+        self._buckets[count + 1][key] = None
+        self._counts[key] = count + 1
+        self._remove_key(key, count)
+        
+    def remove(self, key):
+        """ unregister an item """
+        self._remove_key(key, self._counts.pop(key))
+        
+    def victim(self):
+        """ returns the key of the item that should be evicted next """
+        return next(iter(self._buckets[self._min_count]))
+    
+    
+    
+class StorageMemoryBounded(StorageMemory):
+    """ manages a cache that stores data in a dictionary with bounded size.
+    Items are evicted when the number of items exceeds `max_items` or when the
+    data of all items occupies more than `max_bytes`. The item that is evicted
+    is determined by the `policy`, which can be
+        'lru': the least recently used item is evicted
+        'lfu': the least frequently used item is evicted
+        'ttl': the item that was stored first is evicted
+    Additionally, items expire `ttl` seconds after they have been stored,
+    irrespective of the policy. The number of cache hits, cache misses, and
+    evictions are recorded in the dictionary `statistics`.
+    """
+    
+    policies = {'lru': _EvictionLRU,
+                'lfu': _EvictionLFU,
+                'ttl': _EvictionTTL}
+    
+    
+    def __init__(self, max_items=None, max_bytes=None, policy='lru',
+                 ttl=None, key_builder=None):
+        """ initialize the storage with the given limits """
+        super(StorageMemoryBounded, self).__init__(key_builder=key_builder)
+        try:
+            self._policy = self.policies[policy]()
+        except KeyError:
+            raise ValueError('Unknown eviction policy `%s`. Supported are %s'
+                             % (policy, ', '.join(sorted(self.policies))))
+        if max_items is not None and max_items < 1:
+            raise ValueError('The storage must be able to hold at least one '
+                             'item')
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        
+        self.nbytes = 0
+        self._sizes = {} #< key => number of bytes of the data
+        self._times = collections.OrderedDict() #< key => time when stored
+        self.statistics = {'hits': 0, 'misses': 0, 'evictions': 0}
+        
+        
+    def _is_expired(self, key):
+        """ determines whether the item with the given `key` has expired """
+        return (self.ttl is not None and
+                time.time() - self._times[key] > self.ttl)
+        
+        
+    def purge_expired(self):
+        """ removes all items that have expired """
+        if self.ttl is None:
+            return
+        
+        time_min = time.time() - self.ttl
+        while self._times:
+            key, time_stored = next(self._times.iteritems())
+            if time_stored >= time_min:
+                break
+            del self[key]
+            
+            
+    def _exceeds_limits(self, num_items, nbytes):
+        """ determines whether `num_items` items occupying `nbytes` bytes
+        exceed the limits of the storage """
+        return ((self.max_items is not None and num_items > self.max_items) or
+                (self.max_bytes is not None and nbytes > self.max_bytes))
+        
+        
+    def __len__(self):
+        """ returns the number of items that have not expired """
+        with self._lock:
+            self.purge_expired()
+            return super(StorageMemoryBounded, self).__len__()
+        
+        
+    def __contains__(self, key):
+        """ determines whether an item with the given `key` is stored and has
+        not expired """
+        with self._lock:
+            return (super(StorageMemoryBounded, self).__contains__(key) and
+                    not self._is_expired(key))
+        
+        
+    def __getitem__(self, key):
+        """ retrieve data with given `key` """
+        with self._lock:
+            return self._get_item(key)
+        
+        
+    def _get_item(self, key):
+        """ retrieve data with given `key` while the lock is held """
+        try:
+            data = super(StorageMemoryBounded, self).__getitem__(key)
+        except KeyError:
+            self.statistics['misses'] += 1
+            raise
+        
+        if self._is_expired(key):
+            del self[key]
+            self.statistics['misses'] += 1
+            raise KeyError(key)
+        
+        self.statistics['hits'] += 1
+        self._policy.touch(key)
+        return data
+    
+    
+    def __setitem__(self, key, data):
+        """ store `data` with a given `key` and evict items if necessary """
+        with self._lock:
+            self._set_item(key, data)
+            
+            
+    def _set_item(self, key, data):
+        """ store `data` with a given `key` while the lock is held """
+        if super(StorageMemoryBounded, self).__contains__(key):
+            del self[key] #< also removes expired items
+        self.purge_expired()
+        
+        nbytes = np.asarray(data[0]).nbytes
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            logging.debug('Item `%s` is too large to be stored', key)
+            return
+        
+        # make room for the new item
+        while self._exceeds_limits(len(self) + 1, self.nbytes + nbytes):
+            del self[self._policy.victim()]
+            self.statistics['evictions'] += 1
+        
+        super(StorageMemoryBounded, self).__setitem__(key, data)
+        self._policy.add(key)
+        self._sizes[key] = nbytes
+        self.nbytes += nbytes
+        self._times[key] = time.time()
+            
+            
+    def __delitem__(self, key):
+        """ delete item with given key """
+        with self._lock:
+            super(StorageMemoryBounded, self).__delitem__(key)
+            self._policy.remove(key)
+            self.nbytes -= self._sizes.pop(key)
+            del self._times[key]
@@ -0,0 +1,90 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+
+Storage that is shared between the processes running on the same machine.
+'''
+
+from __future__ import division
+
+import atexit
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+
+from .directory import StorageDirectory
+
+
+
+def get_shared_memory_dir():
+    """ returns the directory of the shared memory of the machine. The
+    temporary directory is used if there is no shared memory directory. """
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    else:
+        return tempfile.gettempdir()
+
+
+
+class StorageSharedMemory(StorageDirectory):
+    """ manages a cache that is kept in the shared memory of the machine
+
+    The items are stored as files in the memory backed file system `/dev/shm`
+    and they are read as memory maps. All processes using the storage thus
+    share the same arrays without copying them. The index of the items is
+    shared using the index log of `StorageDirectory`, which is guarded by a
+    file lock. The storage can be passed to worker processes, e.g., when they
+    are forked by `multiprocessing`, or it can be attached to by creating a
+    storage with the same `name`. The process that created the storage removes
+    it when it exits.
+    """
+
+
+    def __init__(self, name=None, key_builder=None, compact_threshold=1000):
+        """ initialize the storage
+
+        `name` identifies the storage in the shared memory. If the storage does
+            not exist yet, it is created and this process becomes the owner of
+            the storage. If `name` is None, a unique name is chosen.
+        `key_builder` determines how keys are built from the arguments
+        `compact_threshold` is the number of outdated lines in the index log
+            above which the log is rewritten
+        """
+        if name is None:
+            name = 'data_storage_' + uuid.uuid4().hex
+        self.name = name
+        directory = os.path.join(get_shared_memory_dir(), name)
+
+        # the process creating the directory owns the storage
+        try:
+            os.mkdir(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+            self._owner_pid = None
+        else:
+            self._owner_pid = os.getpid()
+            atexit.register(self.unlink)
+
+        super(StorageSharedMemory, self).__init__(
+                directory, mmap_mode='r', key_builder=key_builder,
+                compact_threshold=compact_threshold)
+
+
+    @property
+    def is_owner(self):
+        """ flag indicating whether this process owns the storage """
+        return self._owner_pid == os.getpid()
+
+
+    def unlink(self):
+        """ removes the storage from the shared memory. This is done
+        automatically when the process that created the storage exits. Arrays
+        that are still in use remain valid. """
+        if self.is_owner and os.path.isdir(self.directory):
+            logging.debug('Remove the storage `%s` from the shared memory',
+                          self.name)
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,316 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+
+Storage based on a sqlite database, which handles many small items efficiently.
+'''
+
+from __future__ import division
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from .base import StorageBase
+from .keys import json_default
+
+
+
+class StorageSQLite(StorageBase):
+    """ manages a cache that is stored in a sqlite database
+
+    All items are stored in a single table, where the arrays are kept as raw
+    bytes together with their dtype and shape. The keys of the items, the keys
+    of the keyword arguments and the storage times are indexed columns, such
+    that selecting items by their keyword arguments or by their storage time
+    does not require reading all items. The database uses write-ahead logging,
+    such that other processes can read while one process writes. Each thread
+    uses a separate connection to the database.
+    """
+
+    TABLE_NAME = 'items'
+    # columns that are read to restore an item
+    _ITEM_COLUMNS = 'dtype, shape, data, args, kwargs, internal_data'
+
+
+    def __init__(self, database_file, readonly=False, truncate=False,
+                 temporary=False, key_builder=None, timeout=60):
+        """ initialize the sqlite database
+
+        `database_file` denotes the filename where the database is stored
+        `readonly` is a flag determining whether the database is readonly
+        `truncate` is a flag determining whether the database will be cleared
+            before usage
+        `temporary` indicates whether the database file will be deleted when the
+            objects is deleted
+        `key_builder` determines how keys are built from the arguments
+        `timeout` is the time in seconds to wait for the lock of the database
+            when another process writes to it
+        """
+        super(StorageSQLite, self).__init__(key_builder=key_builder)
+
+        self.filename = database_file
+        self.readonly = readonly
+        self.temporary = temporary
+        self.timeout = timeout
+
+        # connections to the database, which are opened by each thread
+        self._local = threading.local()
+
+        if not readonly:
+            with self._db as db:
+                db.execute('CREATE TABLE IF NOT EXISTS %s ('
+                           'key TEXT PRIMARY KEY, args TEXT, kwargs TEXT, '
+                           'kwargs_key TEXT, internal_data TEXT, '
+                           'time_stored REAL, dtype TEXT, shape TEXT, '
+                           'data BLOB)' % self.TABLE_NAME)
+                db.execute('CREATE INDEX IF NOT EXISTS %s_kwargs ON %s '
+                           '(kwargs_key)' % (self.TABLE_NAME, self.TABLE_NAME))
+                db.execute('CREATE INDEX IF NOT EXISTS %s_time ON %s '
+                           '(time_stored)' % (self.TABLE_NAME, self.TABLE_NAME))
+            if truncate:
+                self.clear()
+
+
+    def __del__(self):
+        """ called before the object is destroyed """
+        connection = getattr(getattr(self, '_local', None), 'connection',
+                             None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+        if getattr(self, 'temporary', False):
+            logging.debug('Delete the database file')
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.filename + suffix):
+                    os.remove(self.filename + suffix)
+
+
+    def __getstate__(self):
+        """ return the state for pickling, which excludes the connections """
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+
+    def __setstate__(self, state):
+        """ restore the storage from the pickled state. Only the original
+        storage deletes a temporary database file. """
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self.temporary = False
+
+
+    @property
+    def _db(self):
+        """ the connection of the current thread to the database. A new
+        connection is also opened in processes that have been forked after the
+        connection was opened. """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            logging.debug('Connect to the sqlite database')
+            local.connection = sqlite3.connect(self.filename,
+                                               timeout=self.timeout)
+            local.connection.text_factory = str
+            if not self.readonly:
+                local.connection.execute('PRAGMA journal_mode=WAL')
+            local.pid = os.getpid()
+        return local.connection
+
+
+    def _select(self, columns, where='', params=()):
+        """ returns a cursor iterating over the `columns` of all rows that
+        satisfy the condition `where` """
+        sql = 'SELECT %s FROM %s' % (columns, self.TABLE_NAME)
+        if where:
+            sql += ' WHERE ' + where
+        return self._db.execute(sql, params)
+
+
+    def _get_conditions(self, time_max=None, kwargs=None):
+        """ returns the condition selecting items stored before `time_max`
+        with the given `kwargs` together with its parameters """
+        conditions, params = [], []
+        if kwargs is not None:
+            conditions.append('kwargs_key = ?')
+            params.append(self.get_kwargs_key(kwargs))
+        if time_max is not None:
+            conditions.append('time_stored < ?')
+            params.append(time_max)
+        return ' AND '.join(conditions), tuple(params)
+
+
+    def _keys_with_kwargs(self, kwargs):
+        """ returns the keys of all items stored with the given `kwargs` """
+        where, params = self._get_conditions(kwargs=kwargs)
+        return [row[0] for row in self._select('key', where, params)]
+
+
+    def _times_with_kwargs(self, kwargs):
+        """ returns the keys of all items stored with the given `kwargs`
+        together with the times when the items were stored """
+        where, params = self._get_conditions(kwargs=kwargs)
+        return [tuple(row)
+                for row in self._select('key, time_stored', where, params)]
+
+
+    def _keys_stored_before(self, time_max):
+        """ returns the keys of all items stored before `time_max` """
+        where, params = self._get_conditions(time_max=time_max)
+        return [row[0] for row in self._select('key', where, params)]
+
+
+    def _all_keys(self):
+        """ returns the keys of all items in the storage """
+        return [row[0] for row in self._select('key')]
+
+
+    def __len__(self):
+        """ return length of the storage """
+        return self._select('COUNT(*)').fetchone()[0]
+
+
+    def __contains__(self, key):
+        """ determines whether an item with the given `key` is stored """
+        return self._select('1', 'key = ?', (key,)).fetchone() is not None
+
+
+    @staticmethod
+    def _decode_array(dtype, shape, data):
+        """ returns the array stored as raw bytes """
+        data_array = np.frombuffer(data, dtype=np.dtype(dtype)).copy()
+        data_array = data_array.reshape(json.loads(shape))
+        if data_array.ndim == 0:
+            return data_array[()]
+        else:
+            return data_array
+
+
+    def _decode_row(self, row):
+        """ returns the value (data_array, args, kwargs, internal_data) from a
+        row with the columns `_ITEM_COLUMNS` """
+        dtype, shape, data, args, kwargs, internal_data = row
+        return (self._decode_array(dtype, shape, data), json.loads(args),
+                json.loads(kwargs), json.loads(internal_data))
+
+
+    def __getitem__(self, key):
+        """ retrieve data with given `key` from the database """
+        row = self._select(self._ITEM_COLUMNS, 'key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        logging.debug('Loaded item `%s` from sqlite database', key)
+        return self._decode_row(row)
+
+
+    def _iter_items(self, keys):
+        """ iterates over the values stored for many `keys` """
+        for key in keys:
+            row = self._select(self._ITEM_COLUMNS, 'key = ?',
+                               (key,)).fetchone()
+            if row is None:
+                yield None
+            else:
+                yield self._decode_row(row)
+
+
+    def _iter_metadata(self, keys):
+        """ iterates over the metadata of many `keys` without reading the
+        stored arrays """
+        for key in keys:
+            row = self._select('args, kwargs, internal_data', 'key = ?',
+                               (key,)).fetchone()
+            if row is None:
+                yield None
+            else:
+                yield tuple(json.loads(col) for col in row)
+
+
+    def iterdata(self, kwargs, ret_extra_data=False):
+        """ iterates through all data that is stored with the given kwargs """
+        where, params = self._get_conditions(kwargs=kwargs)
+        rows = self._select('dtype, shape, data, args, internal_data', where,
+                            params).fetchall()
+        for dtype, shape, data, args, internal_data in rows:
+            c_result = self._decode_array(dtype, shape, data)
+            if ret_extra_data:
+                yield c_result, json.loads(args), json.loads(internal_data)
+            else:
+                yield c_result, json.loads(args)
+
+
+    def clear(self, time_max=None, kwargs=None):
+        """ clears all items from the storage that have been saved before the
+        given time `time_max`. If `time_max` is None, all the data is remove
+        """
+        if self.readonly:
+            raise IOError('Cannot clear readonly database')
+
+        where, params = self._get_conditions(time_max, kwargs)
+        sql = 'DELETE FROM %s' % self.TABLE_NAME
+        if where:
+            sql += ' WHERE ' + where
+        with self._db as db:
+            count = db.execute(sql, params).rowcount
+        logging.debug('Deleted %d items from sqlite database', count)
+
+
+    def _encode_item(self, key, data):
+        """ returns the row storing the value `data` under the given `key` """
+        data_array, args, kwargs, internal_data = data
+        data_array = np.asarray(data_array) #< tobytes uses the C order
+        if data_array.dtype.hasobject:
+            raise TypeError('Arrays of python objects cannot be stored')
+        if internal_data:
+            time_stored = internal_data.get('time_stored')
+        else:
+            time_stored = None
+        return (key, json.dumps(args, default=json_default),
+                json.dumps(kwargs, default=json_default),
+                self.get_kwargs_key(kwargs),
+                json.dumps(internal_data, default=json_default), time_stored,
+                data_array.dtype.str, json.dumps(data_array.shape),
+                sqlite3.Binary(data_array.tobytes()))
+
+
+    def __setitem__(self, key, data):
+        """ store new `data` in the database with a given `key` """
+        self._set_items([(key, data)])
+
+
+    def _set_items(self, items):
+        """ store many `items`, which is a list of tuples (key, data), in a
+        single transaction """
+        if self.readonly:
+            raise IOError('Cannot write to readonly database')
+
+        rows = [self._encode_item(key, data) for key, data in items]
+        with self._db as db:
+            db.executemany('INSERT OR REPLACE INTO %s (key, args, kwargs, '
+                           'kwargs_key, internal_data, time_stored, dtype, '
+                           'shape, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+                           % self.TABLE_NAME, rows)
+        logging.debug('Stored %d items in sqlite database', len(rows))
+
+
+    def __delitem__(self, key):
+        """ delete item with given key """
+        if key not in self:
+            raise KeyError(key)
+        self._del_items([key])
+
+
+    def _del_items(self, keys):
+        """ deletes the items with the given `keys` in a single transaction """
+        if self.readonly:
+            raise IOError('Cannot delete from a readonly database')
+
+        with self._db as db:
+            db.executemany('DELETE FROM %s WHERE key = ?' % self.TABLE_NAME,
+                           [(key,) for key in keys])
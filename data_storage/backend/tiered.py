@@ -0,0 +1,222 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+'''
+
+from __future__ import division
+
+import collections
+import logging
+
+from .base import StorageBase
+from .memory import StorageMemoryBounded
+
+
+
+class StorageTiered(StorageBase):
+    """ manages a cache consisting of a fast memory layer in front of a
+    (persistent) storage. Items are read from the memory layer if possible and
+    items read from the storage are put into the memory layer. Items are
+    written to both layers. If `write_behind` is True, writing to the storage
+    is delayed until `flush` is called or until more than `max_pending` items
+    are waiting to be written.
+    """
+
+    def __init__(self, storage, memory=None, write_behind=False,
+                 max_pending=100):
+        """ initialize the tiered storage
+
+        `storage` is the storage that holds all items
+        `memory` is the storage used as the memory layer. If it is None, a
+            StorageMemoryBounded holding 1000 items is used.
+        `write_behind` is a flag determining whether items are written to the
+            storage only when `flush` is called
+        `max_pending` is the maximal number of items that are not yet written
+            to the storage in write-behind mode
+        """
+        super(StorageTiered, self).__init__()
+        self.storage = storage
+        if memory is None:
+            memory = StorageMemoryBounded(max_items=1000)
+        self.memory = memory
+        self.write_behind = write_behind
+        self.max_pending = max_pending
+        self._pending = collections.OrderedDict() #< items not yet written
+
+
+    def __del__(self):
+        """ write pending items before the object is destroyed """
+        if getattr(self, '_pending', None):
+            self.flush()
+
+
+    def get_key(self, *args):
+        """ returns a key suitable for caching """
+        return self.storage.get_key(*args)
+
+
+    def key_lock(self, key):
+        """ context manager that prevents other processes from calculating
+        the item with the given `key` at the same time """
+        return self.storage.key_lock(key)
+
+
+    def flush(self):
+        """ writes all pending items to the storage """
+        if self._pending:
+            logging.debug('Write %d pending items to the storage',
+                          len(self._pending))
+            items = list(self._pending.iteritems())
+            self._pending.clear()
+            self.storage._set_items(items)
+
+
+    def __len__(self):
+        """ return length of the storage """
+        self.flush()
+        return len(self.storage)
+
+
+    def __contains__(self, key):
+        """ determines whether an item with the given `key` is stored """
+        return key in self._pending or key in self.storage
+
+
+    def __getitem__(self, key):
+        """ retrieve data with given `key` from the fastest layer """
+        try:
+            return self.memory[key]
+        except KeyError:
+            pass
+
+        try:
+            data = self._pending[key]
+        except KeyError:
+            data = self.storage[key]
+        self.memory[key] = data
+        return data
+
+
+    def _get_item_selection(self, key, selection):
+        """ retrieve part of the data with given `key`. The partial data is
+        not put into the memory layer. """
+        if key in self.memory or key in self._pending:
+            return super(StorageTiered, self)._get_item_selection(key,
+                                                                  selection)
+        else:
+            return self.storage._get_item_selection(key, selection)
+
+
+    def __setitem__(self, key, data):
+        """ store `data` with a given `key` in both layers """
+        self._set_items([(key, data)])
+
+
+    def _set_items(self, items):
+        """ store many `items` in both layers """
+        for key, data in items:
+            self.memory[key] = data
+
+        if self.write_behind:
+            self._pending.update(items)
+            if len(self._pending) > self.max_pending:
+                self.flush()
+        else:
+            self.storage._set_items(items)
+
+
+    def __delitem__(self, key):
+        """ delete item with given key from both layers """
+        if key in self.memory:
+            del self.memory[key]
+        if self._pending.pop(key, None) is not None:
+            if key in self.storage:
+                del self.storage[key]
+        else:
+            del self.storage[key]
+
+
+    def clear(self, time_max=None, kwargs=None):
+        """ clears all items from the storage that have been saved before the
+        given time `time_max`. If `time_max` is None, all the data is remove
+        """
+        self.flush()
+        self.memory.clear(time_max, kwargs)
+        self.storage.clear(time_max, kwargs)
+
+
+    def _iter_items(self, keys):
+        """ iterates over the data of many `keys`. Items that are neither in
+        the memory layer nor waiting to be written are read from the storage
+        at once and they are put into the memory layer. """
+        keys = list(keys)
+        values = list(self.memory._iter_items(keys))
+        
+        missing = [] #< indices of the items that need to be read
+        for i, key in enumerate(keys):
+            if values[i] is None:
+                try:
+                    values[i] = self._pending[key]
+                except KeyError:
+                    missing.append(i)
+                else:
+                    self.memory[key] = values[i]
+                    
+        if missing:
+            stored = self.storage._iter_items([keys[i] for i in missing])
+            for i, value in zip(missing, stored):
+                if value is not None:
+                    self.memory[keys[i]] = value
+                values[i] = value
+        return values
+
+
+    def iterdata(self, kwargs, ret_extra_data=False):
+        """ iterates through all data that is stored with the given kwargs
+        without changing the memory layer """
+        self.flush()
+        return self.storage.iterdata(kwargs, ret_extra_data)
+
+
+    def _iter_metadata(self, keys):
+        """ iterates over the metadata of many `keys` """
+        self.flush()
+        return self.storage._iter_metadata(keys)
+
+
+    def _keys_with_kwargs(self, kwargs):
+        """ returns the keys of all items stored with the given `kwargs` """
+        self.flush()
+        return self.storage._keys_with_kwargs(kwargs)
+
+
+    def _times_with_kwargs(self, kwargs):
+        """ returns the keys of all items stored with the given `kwargs`
+        together with the times when the items were stored """
+        self.flush()
+        return self.storage._times_with_kwargs(kwargs)
+
+
+    def _keys_stored_before(self, time_max):
+        """ returns the keys of all items stored before `time_max` """
+        self.flush()
+        return self.storage._keys_stored_before(time_max)
+
+
+    def _all_keys(self):
+        """ returns the keys of all items in the storage """
+        self.flush()
+        return self.storage._all_keys()
+
+
+    def itervalues(self):
+        """ iterates through all values """
+        self.flush()
+        return self.storage.itervalues()
+
+
+    def iteritems(self):
+        """ iterates through all keys and values """
+        self.flush()
+        return self.storage.iteritems()
@@ -0,0 +1,19 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+
+Helper functions shared by the decorators that provide data for functions.
+'''
+
+
+
+def get_kwargs_cache(kwargs, ignore_kwargs=None):
+    """ returns the keyword arguments that determine the stored item, i.e.
+    all items of `kwargs` whose key is not in `ignore_kwargs` """
+    if ignore_kwargs:
+        return {k: v
+                for k, v in kwargs.iteritems()
+                if k not in ignore_kwargs}
+    else:
+        return kwargs
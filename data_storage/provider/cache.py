@@ -4,39 +4,207 @@ Created on Nov 2, 2015
 @author: zwicker
 '''
 
+import collections
 import functools
 import logging
 
+try:
+    from concurrent.futures import Future, as_completed
+except ImportError:
+    Future = None #< futures are waited for in the order of submission
+
+from ..backend.locking import KeyLocks
 from ..backend.memory import StorageMemory
+from .base import get_kwargs_cache
+      
+      
+
+def _calculate_chunk(func_wrapper, args_list, kwargs):
+    """ calculates the results of the cached function `func_wrapper` for the
+    positional arguments in `args_list` without using the cache. This function
+    is defined on the module level, such that it can be sent to other
+    processes. """
+    return func_wrapper._calculate(args_list, kwargs)
       
       
 
-def cached(storage=None, ignore_kwargs=None):
+def cached(storage=None, ignore_kwargs=None, vectorized=False):
     """ function that caches the result of the decorated function in the
-    supplied storage provider """
+    supplied storage provider. If several threads request the same missing
+    item at the same time, only one of them calculates it, while the others
+    wait for the result. The same holds for several processes if the storage
+    supports locking items, see `StorageBase.key_lock`.
+    
+    The decorated function has the additional method `map(args_list,
+    **kwargs)`, which returns the results for all positional arguments in
+    `args_list` by looking up all items at once and storing the missing items
+    at once. If `vectorized` is True, the function must accept lists of values
+    for each positional argument and return a sequence of results. It is then
+    called only once with the arguments of all missing items.
+    
+    Additionally, the method `precompute(args_list, executor=None, **kwargs)`
+    calculates the missing items in parallel, see `precompute` below.
+    """
     
     if storage is None:
         storage = StorageMemory()
     
     def cached_decorator(func):
+        computing = KeyLocks() #< locks of the items that are calculated
+        
+        def calculate(args_list, kwargs):
+            """ calculates the results for all positional arguments in
+            `args_list` """
+            if vectorized:
+                results = list(func(*[list(values)
+                                      for values in zip(*args_list)],
+                                    **kwargs))
+                if len(results) != len(args_list):
+                    raise ValueError('Expected %d results from vectorized '
+                                     'function, but got %d'
+                                     % (len(args_list), len(results)))
+                return results
+            else:
+                return [func(*args, **kwargs) for args in args_list]
         
         @functools.wraps(func)
         def func_wrapper(*args, **kwargs):
-            if ignore_kwargs:
-                kwargs_cache = {k: v
-                                for k, v in kwargs.iteritems()
-                                if k not in ignore_kwargs}
-            else:
-                kwargs_cache = kwargs
+            kwargs_cache = get_kwargs_cache(kwargs, ignore_kwargs)
             
             try:
                 return storage.retrieve(args, kwargs_cache)[0]
             except KeyError:
+                pass
+            
+            # make sure that only one caller calculates the item
+            key = storage.get_key(args, kwargs_cache)
+            with computing.acquire(key), storage.key_lock(key):
+                if key in storage:
+                    # the item has been calculated in the meantime
+                    try:
+                        return storage.retrieve(args, kwargs_cache)[0]
+                    except KeyError:
+                        pass #< the item has been removed again
+                    
                 logging.debug('Calculate function because of missed cache')
-                result = func(*args, **kwargs)
+                result = calculate([args], kwargs)[0]
                 storage.store(result, args=args, kwargs=kwargs_cache)
                 return result
             
+        def func_map(args_list, **kwargs):
+            """ returns the results for all positional arguments in
+            `args_list`. Items that are not tuples are used as the single
+            positional argument. """
+            args_list = [args if isinstance(args, tuple) else (args,)
+                         for args in args_list]
+            kwargs_cache = get_kwargs_cache(kwargs, ignore_kwargs)
+            
+            values = storage.retrieve_many(args_list, kwargs_cache,
+                                           skip_missing=True)
+            results = [None if value is None else value[0]
+                       for value in values]
+            
+            # each missing item is only calculated once
+            missing = collections.OrderedDict() #< key => indices of the item
+            for i, value in enumerate(values):
+                if value is None:
+                    key = storage.get_key(args_list[i], kwargs_cache)
+                    missing.setdefault(key, []).append(i)
+            
+            if missing:
+                logging.debug('Calculate function for %d missed items',
+                              len(missing))
+                missing_args = [args_list[indices[0]]
+                                for indices in missing.itervalues()]
+                missing_results = calculate(missing_args, kwargs)
+                storage.store_many(missing_results, missing_args,
+                                   kwargs_cache)
+                for indices, result in zip(missing.itervalues(),
+                                           missing_results):
+                    for i in indices:
+                        results[i] = result
+            
+            return results
+            
+        def func_precompute(args_list, executor=None, chunk_size=1,
+                            batch_size=16, progress=None, **kwargs):
+            """ calculates the items for all positional arguments in
+            `args_list` that are not yet in the storage. The calculations are
+            submitted to `executor`, e.g. a `concurrent.futures` executor,
+            which only needs to provide the method `submit`. If `executor` is
+            None, the items are calculated in the current thread. The
+            decorated function must be picklable if `executor` runs the tasks
+            in other processes.
+            
+            `chunk_size` is the number of items calculated by each task
+            `batch_size` is the number of results that are collected before
+                they are written to the storage. All results are written by
+                the current thread, such that the storage does not need to
+                support several writers. Results that have been written are
+                skipped when the precomputation is started again.
+            `progress` is a function that is called with the number of
+                calculated items and the number of items to calculate whenever
+                results have been written to the storage
+            
+            Returns the number of items that have been calculated
+            """
+            args_list = [args if isinstance(args, tuple) else (args,)
+                         for args in args_list]
+            kwargs_cache = get_kwargs_cache(kwargs, ignore_kwargs)
+            
+            # items that are already stored or repeated are skipped
+            missing = collections.OrderedDict() #< key => arguments
+            for args in args_list:
+                key = storage.get_key(args, kwargs_cache)
+                if key not in missing and key not in storage:
+                    missing[key] = args
+            missing = missing.values()
+            logging.info('Precompute %d of %d items', len(missing),
+                         len(args_list))
+            chunks = [missing[i:i + chunk_size]
+                      for i in xrange(0, len(missing), chunk_size)]
+            
+            if executor is None:
+                tasks = ((chunk, calculate(chunk, kwargs)) for chunk in chunks)
+            else:
+                futures = collections.OrderedDict(
+                    (executor.submit(_calculate_chunk, func_wrapper, chunk,
+                                     kwargs), chunk)
+                    for chunk in chunks)
+                if Future is not None and all(isinstance(future, Future)
+                                              for future in futures):
+                    futures_done = as_completed(futures)
+                else:
+                    futures_done = futures
+                tasks = ((futures[future], future.result())
+                         for future in futures_done)
+            
+            num_done = 0
+            batch_args, batch_results = [], []
+            try:
+                for chunk, results in tasks:
+                    batch_args.extend(chunk)
+                    batch_results.extend(results)
+                    if len(batch_results) >= batch_size:
+                        storage.store_many(batch_results, batch_args,
+                                           kwargs_cache)
+                        num_done += len(batch_results)
+                        batch_args, batch_results = [], []
+                        if progress is not None:
+                            progress(num_done, len(missing))
+            finally:
+                # store the results that have been calculated so far
+                if batch_results:
+                    storage.store_many(batch_results, batch_args,
+                                       kwargs_cache)
+                    num_done += len(batch_results)
+                    if progress is not None:
+                        progress(num_done, len(missing))
+                    
+            return num_done
+            
+        func_wrapper.map = func_map
+        func_wrapper.precompute = func_precompute
+        func_wrapper._calculate = calculate
         return func_wrapper
     return cached_decorator
-
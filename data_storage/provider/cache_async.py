@@ -0,0 +1,129 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+
+Caching decorator for functions that are called from an asyncio event loop.
+This module requires either `asyncio` or its backport `trollius`.
+'''
+
+from __future__ import division
+
+import functools
+import logging
+
+from ..backend.asynchronous import asyncio, StorageAsync
+from ..backend.memory import StorageMemory
+from .base import get_kwargs_cache
+
+
+
+class _Calculation(object):
+    """ retrieves a single item from the storage or calculates it if it is
+    missing. The steps are chained using callbacks of futures, such that the
+    event loop is never blocked. """
+
+    def __init__(self, func, storage, args, kwargs, kwargs_cache):
+        self.func = func
+        self.storage = storage
+        self.args = args
+        self.kwargs = kwargs
+        self.kwargs_cache = kwargs_cache
+        self.future = asyncio.Future(loop=storage.loop)
+
+
+    def start(self):
+        """ starts looking up the item and returns the future of the result """
+        lookup = self.storage.retrieve(self.args, self.kwargs_cache)
+        lookup.add_done_callback(self._on_retrieved)
+        return self.future
+
+
+    def _on_retrieved(self, lookup):
+        """ calculates the item if it was not found in the storage """
+        if self.future.done():
+            return #< the calculation has been cancelled
+
+        exception = lookup.exception()
+        if exception is None:
+            self.future.set_result(lookup.result()[0])
+        elif not isinstance(exception, KeyError):
+            self.future.set_exception(exception)
+
+        else:
+            logging.debug('Calculate function because of missed cache')
+            loop = self.storage.loop
+            if asyncio.iscoroutinefunction(self.func):
+                # coroutines run in the event loop
+                task = asyncio.ensure_future(self.func(*self.args,
+                                                       **self.kwargs),
+                                             loop=loop)
+            else:
+                # blocking functions run in the executor
+                task = loop.run_in_executor(
+                            self.storage.executor,
+                            functools.partial(self.func, *self.args,
+                                              **self.kwargs))
+            task.add_done_callback(self._on_calculated)
+
+
+    def _on_calculated(self, task):
+        """ stores the calculated item """
+        if task.cancelled():
+            self.future.cancel()
+        elif task.exception() is not None:
+            self.future.set_exception(task.exception())
+        else:
+            result = task.result()
+            storing = self.storage.store(result, args=self.args,
+                                         kwargs=self.kwargs_cache)
+            storing.add_done_callback(functools.partial(self._on_stored,
+                                                        result))
+
+
+    def _on_stored(self, result, storing):
+        """ returns the result after it has been stored """
+        if storing.exception() is not None:
+            logging.warn('Could not store the result: %s', storing.exception())
+        if not self.future.done():
+            self.future.set_result(result)
+
+
+
+def cached_async(storage=None, ignore_kwargs=None, executor=None):
+    """ function that caches the result of the decorated function in the
+    supplied storage provider without blocking the event loop. The decorated
+    function returns a future of the result. The storage is accessed using
+    `executor`, see `StorageAsync`. Coroutine functions are run in the event
+    loop, while other functions are run using `executor`. If the same missing
+    item is requested several times before it has been calculated, all
+    requests receive the result of a single calculation.
+    """
+
+    if storage is None:
+        storage = StorageMemory()
+    if not isinstance(storage, StorageAsync):
+        storage = StorageAsync(storage, executor)
+
+    def cached_decorator(func):
+        computing = {} #< key => future of an item that is being calculated
+
+        @functools.wraps(func)
+        def func_wrapper(*args, **kwargs):
+            kwargs_cache = get_kwargs_cache(kwargs, ignore_kwargs)
+
+            key = storage.get_key(args, kwargs_cache)
+            try:
+                future = computing[key]
+            except KeyError:
+                calculation = _Calculation(func, storage, args, kwargs,
+                                           kwargs_cache)
+                future = calculation.start()
+                computing[key] = future
+                future.add_done_callback(lambda _: computing.pop(key, None))
+
+            # callers can be cancelled without affecting the others
+            return asyncio.shield(future)
+
+        return func_wrapper
+    return cached_decorator
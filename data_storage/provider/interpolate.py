@@ -6,6 +6,7 @@ Created on Nov 8, 2015
 
 from __future__ import division
 
+import collections
 import logging
 import functools
 
@@ -14,6 +15,16 @@ from scipy import interpolate, spatial
 
 from ..backend.base import import_module
 from ..backend.memory import StorageMemory
+from .base import get_kwargs_cache
+
+
+
+def _calculate_point(func_wrapper, point, args, kwargs):
+    """ calculates the result of the interpolated function `func_wrapper` at
+    `point` without using the storage. The task submitted to an executor
+    refers to this function instead of a closure, which could not be pickled
+    for a process pool. """
+    return func_wrapper._calculate(point, *args, **kwargs)
 
 
 
@@ -53,15 +64,122 @@ class Interpolator(object):
                      self._points.shape[0])
 
         self._interpolator = None
+        self._sorted_points = None #< sorted support points in one dimension
+        self._sorted_values = None #< values belonging to the sorted points
+        self._tree = None #< KD-tree of the support points
+        self._triangulation = None #< Delaunay triangulation in n dimensions
+
+    
+    def _get_sorted_data(self):
+        """ returns the support points of a one-dimensional input space and the
+        associated values, both sorted by the position of the points """
+        if self._sorted_points is None:
+            points = self._points[:, 0]
+            if np.all(points[1:] >= points[:-1]):
+                # the points are already sorted, e.g., when they were restored
+                self._sorted_points, self._sorted_values = points, self._values
+            else:
+                order = np.argsort(points)
+                self._sorted_points = points[order]
+                self._sorted_values = self._values[order]
+        return self._sorted_points, self._sorted_values
+
+
+    def _get_tree(self):
+        """ returns a KD-tree of the support points. Points that have been
+        added later are not part of the tree until there are so many of them
+        that the tree is rebuilt """
+        num_points = self._points.shape[0]
+        if (self._tree is None or
+                num_points - self._tree.n > 16 + np.sqrt(self._tree.n)):
+            logging.debug('Build KD-tree of %d support points', num_points)
+            self._tree = spatial.cKDTree(self._points)
+        return self._tree
+
+
+    def _get_triangulation(self):
+        """ returns the Delaunay triangulation of the support points, which
+        can be extended by new points """
+        if self._triangulation is None:
+            logging.debug('Triangulate %d support points',
+                          self._points.shape[0])
+            # joggle the input since the option `Qz`, which deals with points
+            # on regular grids, is not supported in incremental mode
+            self._triangulation = spatial.Delaunay(self._points,
+                                                   incremental=True,
+                                                   qhull_options='QJ')
+        return self._triangulation
 
     
     def get_distance(self, point):
-        """ get minimal distance of a given point to the support points """
+        """ get minimal distance of a given point to the support points. If an
+        array of points is given, an array of distances is returned """
         if self._points.size == 0:
             return np.inf
         
-        return spatial.distance.cdist(np.atleast_2d(self._points),
-                                      np.atleast_2d(point)).min()
+        # determine the shape of the input points (without the interpolation
+        # dimension)
+        point = np.asarray(point, np.double)
+        if self.points_ndim == 1:
+            input_shape = point.shape
+        else:
+            input_shape = point.shape[:-1]
+        point = point.reshape(-1, self._points.shape[1])
+
+        if self._points.shape[1] == 1:
+            # one-dimensional input space: find the neighboring support points
+            support = self._get_sorted_data()[0]
+            point = point[:, 0]
+            idx = np.searchsorted(support, point)
+            left = support[np.clip(idx - 1, 0, len(support) - 1)]
+            right = support[np.clip(idx, 0, len(support) - 1)]
+            dist = np.minimum(np.abs(point - left), np.abs(point - right))
+            
+        else:
+            # n-dimensional input space: query the KD-tree
+            tree = self._get_tree()
+            dist = tree.query(point)[0]
+            if tree.n < self._points.shape[0]:
+                # compare to the points that are not part of the tree
+                dist_new = spatial.distance.cdist(point, self._points[tree.n:])
+                dist = np.minimum(dist, dist_new.min(axis=1))
+            
+        if input_shape:
+            return dist.reshape(input_shape)
+        else:
+            return dist[0]
+        
+        
+    def add_point(self, point, value):
+        """ adds a support point with the associated value. The data structures
+        used for interpolating are updated instead of being rebuilt """
+        point = np.asarray(point, np.double)
+        value = np.asarray(value)
+        if self._points.shape[0] == 0:
+            # the dimensions of the data are only known now
+            self.__init__(point[None], value[None])
+            return
+        
+        if value.shape != self.values_shape:
+            raise ValueError('Value of shape %s cannot be added to values of '
+                             'shape %s' % (value.shape, self.values_shape))
+        point = point.reshape(1, self._points.shape[1])
+        value = value.reshape((1,) + self._values.shape[1:])
+        
+        self._points = np.concatenate((self._points, point))
+        self._values = np.concatenate((self._values, value))
+
+        if self._sorted_points is not None:
+            # insert the point into the sorted support points
+            idx = np.searchsorted(self._sorted_points, point[0, 0])
+            self._sorted_points = np.insert(self._sorted_points, idx,
+                                            point[0, 0])
+            self._sorted_values = np.insert(self._sorted_values, idx, value[0],
+                                            axis=0)
+        if self._triangulation is not None:
+            self._triangulation.add_points(point)
+        
+        self._interpolator = None #< is recreated from the updated data
     
     
     def __call__(self, point):
@@ -72,13 +190,15 @@ class Interpolator(object):
         if self._interpolator is None:
             if self.points_ndim == 1 or self._points.shape[1] == 1:
                 # one-dimensional interpolation
+                points, values = self._get_sorted_data()
                 self._interpolator = interpolate.interp1d(
-                          self._points.flat, self._values, axis=0, copy=False)
+                          points, values, axis=0, copy=False,
+                          assume_sorted=True)
                 
             else:
                 # n-dimensional interpolation
                 self._interpolator = interpolate.LinearNDInterpolator(
-                                                    self._points, self._values)
+                                        self._get_triangulation(), self._values)
         
         # determine the shape of the input points (without the interpolation
         # dimension)
@@ -91,6 +211,34 @@ class Interpolator(object):
         result_shape = input_shape + self.values_shape
 
         return self._interpolator(point).reshape(result_shape)
+    
+    
+    def storage_prepare(self):
+        """ prepare the interpolator for storage. The support points and the
+        associated values are stored in a single array with one row per support
+        point. One-dimensional support points are stored in sorted order. """
+        if self._points.shape[1] == 1:
+            points, values = self._get_sorted_data()
+            points = points[:, None]
+        else:
+            points, values = self._points, self._values
+        data_array = np.hstack((points, values.reshape(len(points), -1)))
+        properties = {'points_ndim': self.points_ndim,
+                      'points_dim': points.shape[1],
+                      'values_shape': list(self.values_shape)}
+        return data_array, properties
+    
+    
+    @classmethod
+    def storage_retrieve(cls, data_array, extra_data):
+        """ create the interpolator from retrieved data """
+        data_array = np.asarray(data_array)
+        dim = extra_data['points_dim']
+        points = data_array[:, :dim]
+        if extra_data['points_ndim'] == 1:
+            points = points[:, 0]
+        values_shape = (len(data_array),) + tuple(extra_data['values_shape'])
+        return cls(points, data_array[:, dim:].reshape(values_shape))
         
 
 
@@ -100,100 +248,246 @@ class interpolated(object):
     already calculated data points the result is calculated by interpolating
     between previous results instead. Here, the interpolation is done on all
     the values that are supplied by as positional arguments.    
+    
+    The decorated function has the additional method `map(points, args=(),
+    executor=None, **kwargs)`, which returns the results for many points at
+    once, see `func_map` below.
+    
+    If `interpolator_storage` is given, interpolators that are constructed
+    from the stored results are written to this separate storage, such that
+    they never mix with the results. They are read instead of all results as
+    long as no results have been added or removed since, which is checked
+    using `StorageBase.get_kwargs_version`.
     """
     
-    def __init__(self, storage=None, max_distance=1, ignore_kwargs=None):
+    def __init__(self, storage=None, max_distance=1, ignore_kwargs=None,
+                 max_interpolators=32, interpolator_storage=None):
         """ initialize the decorator with a storage class and a cutoff distance
-        determining the minimal distance to the closest support point """
+        determining the minimal distance to the closest support point. The
+        interpolators of the `max_interpolators` most recently used sets of
+        keyword arguments are kept in memory. """
         if storage is None:
             self.storage = StorageMemory()
         else:
             self.storage = storage
+        if storage is not None and interpolator_storage is storage:
+            raise ValueError('Interpolators must be stored separately from '
+                             'the results')
         self.max_distance = max_distance
         self.ignore_kwargs = ignore_kwargs
+        self.max_interpolators = max_interpolators
+        self.interpolator_storage = interpolator_storage
         
-        self._interpolator = None
-        self._interpolator_kwargs = None
-        self._obj_extra_data = None
+        # kwargs key => (interpolator, example extra data of the results)
+        self._interpolators = collections.OrderedDict()
     
     
-    def get_interpolator(self, kwargs):
-        """ get the interpolator for the given kwargs """
-        if self._interpolator is None or self._interpolator_kwargs != kwargs:
+    def _load_interpolator(self, kwargs):
+        """ construct the interpolator for the given kwargs from the stored
+        results. Returns the interpolator together with the extra data of one
+        of the results, which is None if there are no results """
+        if self.interpolator_storage is not None:
+            # try reading an interpolator that has been stored before
+            version = self.storage.get_kwargs_version(kwargs)
+            state_args = (self.storage.get_kwargs_key(kwargs),)
+            try:
+                value = self.interpolator_storage.retrieve(state_args, {})
+            except KeyError:
+                pass
+            else:
+                interpolator, _, _, extra_data = value
+                if extra_data.get('version') == version:
+                    logging.debug('Read stored interpolator for kwargs=%s',
+                                  kwargs)
+                    return interpolator, extra_data['result_extra_data']
         
-            logging.debug('Construct interpolator for kwargs=%s', kwargs)
+        logging.debug('Construct interpolator for kwargs=%s', kwargs)
+    
+        points = []
+        values = []
+        obj_extra_data = None
         
-            points = []
-            values = []
+        iterator = self.storage.iterdata(kwargs, ret_extra_data=True)
+        value_shape = None
+        for c_result, c_args, c_extra_data in iterator:
+            # test the shape of the result for consistency
+            try:
+                result_shape = c_result.shape
+            except AttributeError:
+                # result does not have any shape
+                pass
+            else:
+                # test whether the shapes of all results are the same 
+                if value_shape is None:
+                    value_shape = result_shape
+                elif value_shape != result_shape:
+                    raise RuntimeError()
             
-            iterator = self.storage.iterdata(kwargs, ret_extra_data=True)
-            value_shape = None
-            for c_result, c_args, c_extra_data in iterator:
-                # test the shape of the result for consistency
-                try:
-                    result_shape = c_result.shape
-                except AttributeError:
-                    # result does not have any shape
-                    pass
-                else:
-                    # test whether the shapes of all results are the same 
-                    if value_shape is None:
-                        value_shape = result_shape
-                    elif value_shape != result_shape:
-                        raise RuntimeError()
-                
-                # store the data necessary for interpolation
-                points.append(np.array(c_args[0]))
-                values.append(c_result)
-                self._obj_extra_data = c_extra_data #< store example extra data
-                
-            if value_shape is None:
-                value_shape = tuple()
-                
-            logging.debug('Found %d data points with shape %s',
-                          len(values), value_shape)
-                    
-            self._interpolator = Interpolator(points, values)
+            # store the data necessary for interpolation
+            points.append(np.array(c_args[0]))
+            values.append(c_result)
+            obj_extra_data = c_extra_data #< store example extra data
+            
+        if value_shape is None:
+            value_shape = tuple()
             
-        return self._interpolator
+        logging.debug('Found %d data points with shape %s',
+                      len(values), value_shape)
+        
+        interpolator = Interpolator(points, values)
+        if (self.interpolator_storage is not None and
+                obj_extra_data is not None):
+            # store the interpolator together with the version of the results
+            internal_data = {'version': version,
+                             'result_extra_data': obj_extra_data}
+            self.interpolator_storage.store(interpolator, state_args, {},
+                                            internal_data=internal_data)
+                
+        return interpolator, obj_extra_data
+    
+    
+    def _get_interpolator_data(self, kwargs):
+        """ get the interpolator for the given kwargs together with the extra
+        data of one of the results. The interpolator is only constructed if it
+        is not among the recently used ones """
+        kwargs_key = self.storage.get_kwargs_key(kwargs)
+        try:
+            data = self._interpolators.pop(kwargs_key)
+        except KeyError:
+            data = self._load_interpolator(kwargs)
+            # discard the least recently used interpolators
+            while len(self._interpolators) >= max(1, self.max_interpolators):
+                self._interpolators.popitem(last=False)
+        self._interpolators[kwargs_key] = data #< mark as most recently used
+        return data
+    
+    
+    def get_interpolator(self, kwargs):
+        """ get the interpolator for the given kwargs """
+        return self._get_interpolator_data(kwargs)[0]
     
     
     def __call__(self, func):
         """ decorate the given function """
         
+        def create_result(data, args, obj_extra_data):
+            """ creates the result from the interpolated `data` """
+            if obj_extra_data.has_key('obj_class'):
+                # result is an object and not just a numpy array
+                extra_data = obj_extra_data
+                module =  import_module(extra_data['obj_module'])
+                cls = getattr(module, extra_data['obj_class'])
+                return cls.create_from_interpolated(
+                                        data, args, extra_data['obj_props'])
+            else:
+                return data
+            
+        def add_results(points, results, args, kwargs_cache, interpolator,
+                        obj_extra_data):
+            """ stores the calculated `results` and adds them to the
+            interpolator """
+            self.storage.store_many(results,
+                                    [(point,) + args for point in points],
+                                    kwargs_cache)
+            
+            if obj_extra_data is None:
+                # rebuild the interpolator to determine the extra data
+                kwargs_key = self.storage.get_kwargs_key(kwargs_cache)
+                self._interpolators.pop(kwargs_key, None)
+            else:
+                # add the new support points to the interpolator
+                for point, result in zip(points, results):
+                    try:
+                        value = result.storage_prepare()[0]
+                    except AttributeError:
+                        value = result
+                    interpolator.add_point(point, value)
+        
         @functools.wraps(func)
         def func_wrapper(point, *args, **kwargs):
             # get the kwargs that go into the cache key
-            if self.ignore_kwargs:
-                kwargs_cache = {k: v
-                                for k, v in kwargs.iteritems()
-                                if k not in self.ignore_kwargs}
-            else:
-                kwargs_cache = kwargs
+            kwargs_cache = get_kwargs_cache(kwargs, self.ignore_kwargs)
 
             # try to interpolate
-            interpolator = self.get_interpolator(kwargs_cache)
+            interpolator, obj_extra_data = \
+                                    self._get_interpolator_data(kwargs_cache)
             if interpolator.get_distance(point) <= self.max_distance:
                 # use the interpolator to get the result
-                result = interpolator(point)
-                if self._obj_extra_data.has_key('obj_class'):
-                    # result is an object and not just a numpy array
-                    extra_data = self._obj_extra_data
-                    module =  import_module(extra_data['obj_module'])
-                    cls = getattr(module, extra_data['obj_class'])
-                    result = cls.create_from_interpolated(
-                                          result, args, extra_data['obj_props'])
+                result = create_result(interpolator(point), args,
+                                       obj_extra_data)
                     
             else:
                 # recalculate the result since support points are too far
                 logging.debug('Calculate result at point=%s', point)
                 result = func(point, *args, **kwargs)
-                args_full = (point,) + args
-                self.storage.store(result, args=args_full, kwargs=kwargs_cache)
-                self._interpolator = None #< devalidate interpolator
+                add_results([point], [result], args, kwargs_cache,
+                            interpolator, obj_extra_data)
                 
             return result
+        
+        def func_map(points, args=(), executor=None, **kwargs):
+            """ returns the results for all `points`. The function is called
+            with the additional positional arguments `args` and the keyword
+            arguments `kwargs`. The results at points that are close to support
+            points are interpolated in a single call. The results at all other
+            points are calculated, where the calculations are submitted to
+            `executor` if it is given, which requires an importable function
+            if the executor uses worker processes. Repeated points are only
+            calculated once. The calculated results are stored at once and
+            they are not used for interpolating the results at the other
+            points of the same call. """
+            points = list(points)
+            kwargs_cache = get_kwargs_cache(kwargs, self.ignore_kwargs)
+            interpolator, obj_extra_data = \
+                                    self._get_interpolator_data(kwargs_cache)
+            
+            # determine the points that are close enough to support points
+            is_close = np.zeros(len(points), bool)
+            if points:
+                distances = interpolator.get_distance(np.array(points))
+                is_close[:] = distances <= self.max_distance
+            close = np.flatnonzero(is_close)
+            results = [None] * len(points)
+            
+            # each distant point is only calculated once
+            distant = collections.OrderedDict() #< key => indices of the point
+            for i in np.flatnonzero(~is_close):
+                key = self.storage.get_key((points[i],) + args, kwargs_cache)
+                distant.setdefault(key, []).append(i)
+            
+            if len(close) > 0:
+                # interpolate the results in a single call
+                data = interpolator(np.array([points[i] for i in close]))
+                for i, data_point in zip(close, data):
+                    results[i] = create_result(data_point, args,
+                                               obj_extra_data)
+            
+            if distant:
+                # calculate the results since support points are too far
+                logging.debug('Calculate result at %d of %d points',
+                              len(distant), len(points))
+                distant_points = [points[indices[0]]
+                                  for indices in distant.itervalues()]
+                if executor is None:
+                    distant_results = [func(point, *args, **kwargs)
+                                       for point in distant_points]
+                else:
+                    futures = [executor.submit(_calculate_point, func_wrapper,
+                                               point, args, kwargs)
+                               for point in distant_points]
+                    distant_results = [future.result() for future in futures]
+                    
+                add_results(distant_points, distant_results, args,
+                            kwargs_cache, interpolator, obj_extra_data)
+                for indices, result in zip(distant.itervalues(),
+                                           distant_results):
+                    for i in indices:
+                        results[i] = result
+                
+            return results
             
+        func_wrapper.map = func_map
+        func_wrapper._calculate = func
         return func_wrapper
     
     
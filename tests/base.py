@@ -79,6 +79,20 @@ class SimpleResult(object):
 
 
 
+class Executor(object):
+    """ executor submitting tasks to a multiprocessing pool """
+    
+    def __init__(self, pool):
+        self.pool = pool
+        
+    def submit(self, func, *args):
+        """ submit a task and return an object providing its result """
+        result = self.pool.apply_async(func, args)
+        result.result = result.get
+        return result
+
+
+
 class TestBase(unittest.TestCase):
     """ extends the basic TestCase class with some convenience functions """ 
       
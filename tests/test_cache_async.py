@@ -0,0 +1,105 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+'''
+
+from __future__ import division
+
+import tempfile
+import time
+import unittest
+
+from data_storage import StorageMemory
+from data_storage.backend.asynchronous import asyncio, StorageAsync
+from data_storage.backend.hdf5 import StorageHDF5
+
+if asyncio is not None:
+    from data_storage.provider.cache_async import cached_async
+
+
+
+@unittest.skipIf(asyncio is None, 'asyncio is not available')
+class TestCacheAsync(unittest.TestCase):
+    """ test caching functions that are called from an event loop """
+
+    _multiprocess_can_split_ = True #< let nose know that tests can run parallel
+
+
+    def setUp(self):
+        """ initialize tests """
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+
+    def tearDown(self):
+        """ close the event loop """
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+
+    def run_all(self, *futures):
+        """ returns the results of all `futures` """
+        return self.loop.run_until_complete(asyncio.gather(*futures))
+
+
+    def test_storage(self):
+        """ test the asynchronous facade of a storage """
+        file_tmp = tempfile.NamedTemporaryFile(suffix='hdf5', delete=False)
+        storage = StorageAsync(StorageHDF5(file_tmp.name, temporary=True))
+
+        self.run_all(storage.store(4, (2,)), storage.store_many([1, 9],
+                                                                [(1,), (3,)]))
+        results = self.run_all(storage.retrieve((2,), {}),
+                               storage.retrieve_many([(1,), (3,)]),
+                               storage.contains(storage.get_key((3,), {})))
+        self.assertEqual(results[0][0], 4)
+        self.assertEqual([res[0] for res in results[1]], [1, 9])
+        self.assertTrue(results[2])
+
+        self.run_all(storage.clear())
+        self.assertRaises(KeyError, self.loop.run_until_complete,
+                          storage.retrieve((2,), {}))
+
+
+    def test_blocking(self):
+        """ test caching a blocking function """
+        storage = StorageMemory()
+        calls = []
+
+        @cached_async(storage)
+        def square(x):
+            calls.append(x)
+            time.sleep(0.05)
+            return x**2
+
+        results = self.run_all(*[square(x % 2) for x in range(10)])
+        self.assertEqual(results, [0, 1] * 5)
+        self.assertEqual(sorted(calls), [0, 1])
+        self.assertEqual(len(storage), 2)
+
+        self.assertEqual(self.run_all(square(1), square(2)), [1, 4])
+        self.assertEqual(sorted(calls), [0, 1, 2])
+
+
+    @unittest.skipIf(not hasattr(asyncio, 'Return'),
+                     'coroutines need to be defined using trollius')
+    def test_coroutine(self):
+        """ test caching a coroutine function """
+        calls = []
+
+        @cached_async()
+        @asyncio.coroutine
+        def square(x):
+            calls.append(x)
+            yield asyncio.From(asyncio.sleep(0.01))
+            if x < 0:
+                raise ValueError('negative value')
+            raise asyncio.Return(x**2)
+
+        self.assertEqual(self.run_all(square(2), square(2), square(3)),
+                         [4, 4, 9])
+        self.assertEqual(self.run_all(square(2)), [4])
+        self.assertEqual(calls, [2, 3])
+        self.assertRaises(ValueError, self.run_all, square(-1))
+
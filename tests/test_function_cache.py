@@ -6,13 +6,26 @@ Created on Nov 7, 2015
 
 from __future__ import division
 
+import multiprocessing
+import multiprocessing.pool
 import os
+import pickle
 import unittest
 import tempfile
+import threading
+import time
+import json
 
-from data_storage import StorageMemory, cached
-from data_storage.backend.hdf5 import StorageHDF5
-from .base import SimpleResult
+import numpy as np
+import h5py
+
+from data_storage import StorageMemory, StorageMemoryBounded, cached
+from data_storage.backend.directory import StorageDirectory
+from data_storage.backend.hdf5 import StorageHDF5, get_chunk_shape
+from data_storage.backend.shared import StorageSharedMemory
+from data_storage.backend.sqlite import StorageSQLite
+from data_storage.backend.tiered import StorageTiered
+from .base import TestBase, SimpleResult, Executor
 
 
       
@@ -37,7 +50,13 @@ class TestSimplestUsesage(unittest.TestCase):
       
       
       
-class TestFunctionCache(unittest.TestCase):
+def _cube(x):
+    """ function that is cached when precomputing items in other processes """
+    return x**3
+        
+        
+        
+class TestFunctionCache(TestBase):
     """ test caches using a simple dictionary as the storage backend """
 
     _multiprocess_can_split_ = True #< let nose know that tests can run parallel
@@ -111,6 +130,79 @@ class TestFunctionCache(unittest.TestCase):
         self.assertEqual(len(self.storage), 3)        
         
         
+    def test_clear_time(self):
+        """ test clearing the cache based on the time """
+
+        self.storage.store(1, [1], {'e': 2}, {'time_stored': 10})
+        self.storage.store(2, [2], {'e': 2}, {'time_stored': 20})
+        self.storage.store(3, [3], {'e': 3}, {'time_stored': 15})
+        self.storage.store(4, [4], {'e': 3}, {'time_stored': 30})
+        self.assertEqual(len(self.storage), 4)
+
+        data = sorted(self.storage.iterdata({'e': 3}))
+        self.assertEqual(data, [(3, [3]), (4, [4])])
+
+        self.storage.clear(time_max=20, kwargs={'e': 2})
+        self.assertEqual(len(self.storage), 3)
+        self.assertEqual(list(self.storage.iterdata({'e': 2})), [(2, [2])])
+
+        self.storage.clear(time_max=25)
+        self.assertEqual(len(self.storage), 1)
+        self.assertEqual(self.storage.retrieve((4,), {'e': 3})[0], 4)
+        self.assertEqual(list(self.storage.iterdata({'e': 2})), [])
+
+
+    def test_itermeta(self):
+        """ test iterating over the metadata """
+
+        self.storage.store(1, [1], {'e': 2}, {'time_stored': 10})
+        self.storage.store(2, [2], {'e': 3}, {'time_stored': 20})
+
+        meta = sorted(m[1:] for m in self.storage.itermeta())
+        self.assertEqual(meta, [([1], {'e': 2}, {'time_stored': 10}),
+                                ([2], {'e': 3}, {'time_stored': 20})])
+
+        meta = list(self.storage.itermeta({'e': 3}))
+        self.assertEqual(len(meta), 1)
+        key, args, kwargs, internal_data = meta[0]
+        self.assertEqual(self.storage[key][0], 2)
+        self.assertEqual(args, [2])
+        self.assertEqual(internal_data['time_stored'], 20)
+
+
+    def test_numpy_args(self):
+        """ test caching a function with numpy arguments """
+        
+        @cached(self.storage)
+        def func(arr, x):
+            return arr * x
+        
+        a = func(np.arange(3), np.float32(2))
+        self.assertEqual(len(self.storage), 1)
+        np.testing.assert_array_equal(a, [0, 2, 4])
+        
+        b = func(np.arange(3), 2.)
+        self.assertEqual(len(self.storage), 1)
+        np.testing.assert_array_equal(a, b)
+        
+        func(np.arange(1, 4), 2.)
+        self.assertEqual(len(self.storage), 2)
+        
+        
+    def test_selection(self):
+        """ test retrieving part of the stored arrays """
+        data = np.arange(24).reshape(4, 6)
+        self.storage.store(data, (1,))
+        
+        for selection in (np.s_[2], np.s_[1:3, ::2], np.s_[..., -1], 
+                          np.s_[[0, 2]]):
+            result = self.storage.retrieve((1,), {}, selection=selection)[0]
+            np.testing.assert_array_equal(result, data[selection])
+            
+        self.assertRaises(KeyError, self.storage.retrieve, (2,), {},
+                          selection=np.s_[2])
+        
+        
     def test_ignore_args(self):
         """ test ignoring some of the arguments """
         
@@ -157,7 +249,169 @@ class TestFunctionCache(unittest.TestCase):
         self.assertEqual(len(self.storage), 1)        
 
         self.assertEqual(a, square_cached(2, e=2))
-        self.assertEqual(len(self.storage), 2)  
+        self.assertEqual(len(self.storage), 2)
+
+
+    def test_store_many(self):
+        """ test storing and retrieving many items at once """
+
+        self.storage.store_many([1, 4, SimpleResult(9, 3)],
+                                [(1,), (2,), (3,)], {'e': 2})
+        self.assertEqual(len(self.storage), 3)
+        self.assertEqual(self.storage.retrieve((2,), {'e': 2})[0], 4)
+
+        self.storage.store_many([8], [(2,)], [{'e': 3}])
+        self.assertEqual(len(self.storage), 4)
+
+        results = self.storage.retrieve_many([(1,), (3,), (2,)], {'e': 2})
+        self.assertEqual([res[0] for res in results],
+                         [1, SimpleResult(9, 3), 4])
+
+        args_list = [(2,), (1,)]
+        kwargs_list = [{'e': 3}, {'e': 3}]
+        self.assertRaises(KeyError, self.storage.retrieve_many, args_list,
+                          kwargs_list)
+        results = self.storage.retrieve_many(args_list, kwargs_list,
+                                             skip_missing=True)
+        self.assertEqual(results[0][0], 8)
+        self.assertIsNone(results[1])
+        
+        # only the last result of repeated arguments is stored
+        self.storage.store_many([5, 6], [(5,), (5,)])
+        self.assertEqual(len(self.storage), 5)
+        self.assertEqual(self.storage.retrieve((5,), {})[0], 6)
+        
+        
+    def test_pickle(self):
+        """ test pickling a storage that contains items """
+        self.storage.store(np.arange(3), (1,), {'e': 2})
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            storage = pickle.loads(pickle.dumps(self.storage, protocol))
+            self.assertEqual(len(storage), 1)
+            self.assertEqual(storage.retrieve((1,), {'e': 2})[0].tolist(),
+                             [0, 1, 2])
+            self.assertEqual(len(list(storage.iterdata({'e': 2}))), 1)
+            del storage
+        self.assertEqual(len(self.storage), 1)
+        
+        
+    def test_single_flight(self):
+        """ test that concurrent calls calculate an item only once """
+        calls = []
+        
+        @cached(self.storage)
+        def square(x):
+            calls.append(x)
+            time.sleep(0.05)
+            return x**2
+        
+        results = []
+        threads = [threading.Thread(target=lambda x: results.append(square(x)),
+                                    args=(i % 2,))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(sorted(calls), [0, 1])
+        self.assertEqual(sorted(results), [0] * 5 + [1] * 5)
+        
+        
+    def test_map(self):
+        """ test calculating many items at once """
+        calls = []
+        
+        @cached(self.storage)
+        def power(x, e=2):
+            calls.append(x)
+            return x**e
+        
+        self.assertEqual(power(2), 4)
+        self.assertEqual(power.map([1, 2, 3]), [1, 4, 9])
+        self.assertEqual(calls, [2, 1, 3])
+        self.assertEqual(power.map([(3,), (4,)], e=3), [27, 64])
+        self.assertEqual(len(self.storage), 5)
+        self.assertEqual(power(4, e=3), 64)
+        self.assertEqual(len(calls), 5)
+        
+        # repeated items are only calculated once
+        self.assertEqual(power.map([5, 6, 5, (6,)]), [25, 36, 25, 36])
+        self.assertEqual(calls[5:], [5, 6])
+        
+        @cached(self.storage, vectorized=True)
+        def cube(xs):
+            calls.append(list(xs))
+            return np.asarray(xs)**3
+        
+        del calls[:]
+        self.assertEqual(cube.map([10, 11, 12]), [1000, 1331, 1728])
+        self.assertEqual(cube.map([12, 13, 10]), [1728, 2197, 1000])
+        self.assertEqual(cube(14), 2744)
+        self.assertEqual(calls, [[10, 11, 12], [13], [14]])
+        
+        
+    def test_precompute(self):
+        """ test calculating many items in parallel """
+        calls = []
+        
+        @cached(self.storage)
+        def power(x, e=2):
+            calls.append(x)
+            return x**e
+        
+        power(1)
+        
+        # interrupt the calculation after the first batch has been written
+        def interrupt(num_done, num_total):
+            self.assertEqual(num_total, 5)
+            if num_done < num_total:
+                raise KeyboardInterrupt
+        
+        self.assertRaises(KeyboardInterrupt, power.precompute, range(6),
+                          batch_size=2, progress=interrupt)
+        self.assertEqual(len(self.storage), 3)
+        
+        # resume the calculation
+        pool = multiprocessing.pool.ThreadPool(2)
+        try:
+            num = power.precompute(range(6), executor=Executor(pool),
+                                   chunk_size=2)
+        finally:
+            pool.close()
+        self.assertEqual(num, 3)
+        self.assertEqual(sorted(calls), range(6))
+        self.assertEqual(power.map(range(6)), [x**2 for x in range(6)])
+        
+        self.assertEqual(power.precompute(range(6), e=3), 6)
+        self.assertEqual(power(2, e=3), 8)
+        self.assertEqual(power.precompute([7, 8, 7, (8,)]), 2)
+        
+        
+    def test_precompute_processes(self):
+        """ test precomputing items in other processes """
+        func = _cube
+        cube = cached(self.storage)(func)
+        globals()['_cube'] = cube #< the processes look up the function by name
+        pool = multiprocessing.Pool(2)
+        try:
+            num = cube.precompute(range(4), executor=Executor(pool))
+        finally:
+            pool.close()
+            pool.join()
+            globals()['_cube'] = func
+        self.assertEqual(num, 4)
+        self.assertEqual(len(self.storage), 4)
+        self.assertEqual(cube.map(range(4)), [0, 1, 8, 27])
+        
+                
+        
+class TestFunctionCacheMemoryBounded(TestFunctionCache):
+    """ test caches using a bounded dictionary as the storage backend """            
+            
+    def setUp(self):
+        """ initialize tests """
+        self.storage = StorageMemoryBounded(max_items=100)
         
                 
         
@@ -194,3 +448,596 @@ class TestFunctionCacheHDF5(TestFunctionCache):
         self.assertEqual(len(self.storage), 1)
         
         self.assertGreater(size1, size2)
+
+
+    def test_dead_space(self):
+        """ test determining the space occupied by deleted items """
+        self.storage.store(np.zeros(10000), (1,))
+        self.storage.store(np.zeros(10000), (2,))
+        self.assertEqual(self.storage.get_dead_space(), 0)
+        
+        self.storage.clear(kwargs={})
+        self.assertEqual(self.storage.get_dead_space(), 160000)
+        self.storage.store(np.zeros(5000), (1,))
+        self.storage.store(np.zeros(5000), (1,)) #< overwrite the item
+        self.assertEqual(self.storage.get_dead_space(), 200000)
+        self.assertGreater(self.storage.get_dead_fraction(), 0.5)
+        
+        # the dead space needs to be determined from the file
+        storage = StorageHDF5(self.storage.filename, readonly=True)
+        self.assertEqual(storage.get_dead_space(), 200000)
+        
+        self.storage.repack()
+        self.assertEqual(len(self.storage), 1)
+        self.assertEqual(self.storage.get_dead_space(), 0)
+        self.assertEqual(self.storage.retrieve((1,), {})[0].shape, (5000,))
+        
+        
+    def test_rebuild_index_arrays(self):
+        """ test rebuilding the index of items with array arguments """
+        args = (np.arange(3.),)
+        self.storage.store(1, args, {'e': np.arange(2)})
+        self.storage.rebuild_index()
+        self.assertEqual(self.storage.retrieve(args, {'e': np.arange(2)})[0],
+                         1)
+        self.assertEqual(len(list(self.storage.iterdata({'e': np.arange(2)}))),
+                         1)
+        
+        
+    def test_store_many_repeated(self):
+        """ test that repeated keys in a batch do not leave stale items """
+        self.storage.store_many([1, 2], [(1,), (1,)])
+        del self.storage[self.storage.get_key((1,), {})]
+        
+        storage = StorageHDF5(self.storage.filename, readonly=True)
+        self.assertEqual(len(storage), 0)
+        storage.rebuild_index()
+        self.assertEqual(len(storage), 0)
+        
+        
+    def test_repack_threshold(self):
+        """ test repacking the file automatically """
+        self.storage.repack_threshold = 0.5
+        for x in range(3):
+            self.storage.store(np.zeros(10000), (x,))
+            
+        self.storage.clear(kwargs={}, time_max=0)
+        self.assertEqual(len(self.storage), 3)
+        del self.storage[self.storage.get_key((0,), {})]
+        self.assertGreater(self.storage.get_dead_space(), 0)
+        
+        del self.storage[self.storage.get_key((1,), {})]
+        self.assertEqual(self.storage.get_dead_space(), 0)
+        self.assertEqual(len(self.storage), 1)
+        self.assertEqual(self.storage.retrieve((2,), {})[0].shape, (10000,))
+        
+        
+    def test_compression(self):
+        """ test storing compressed arrays """
+        data = np.zeros((100, 50))
+        self.storage.store(data, (1,))
+        self.storage.store(data, (2,), compression='gzip', chunks='auto')
+        self.storage.store(1, (3,), compression='gzip')
+        self.storage.store_many([data], [(4,)], compression='lzf',
+                                shuffle=True, chunks=(10, 50))
+        self.assertRaises(ValueError, self.storage.store, data, (5,),
+                          compress='gzip')
+        
+        for x, compression, chunks in ((1, None, None), (2, 'gzip', (100, 50)),
+                                       (3, None, None), (4, 'lzf', (10, 50))):
+            self.assertAllClose(self.storage.retrieve((x,), {})[0],
+                                1 if x == 3 else data)
+            name = self.storage._index[self.storage.get_key((x,), {})]
+            with h5py.File(self.storage.filename, 'r') as db:
+                self.assertEqual(db[name].compression, compression)
+                self.assertEqual(db[name].chunks, chunks)
+                
+                
+    def test_chunk_shape(self):
+        """ test determining the shape of chunks """
+        self.assertEqual(get_chunk_shape((10, 20), 8), (10, 20))
+        self.assertEqual(get_chunk_shape((10, 20), 8, chunk_bytes=400),
+                         (2, 20))
+        self.assertEqual(get_chunk_shape((10, 20), 8, chunk_bytes=100),
+                         (1, 10))
+        
+        
+    def test_index(self):
+        """ test the index that is stored in the hdf5 file """
+
+        @cached(self.storage)
+        def square(x, e=2):
+            return x**e
+
+        square(2, e=2)
+        square(2, e=3)
+        self.storage.clear(kwargs={'e': 2})
+
+        # the stored index must be used when the file is opened again
+        storage = StorageHDF5(self.storage.filename, readonly=True)
+        storage.rebuild_index = None #< make sure the index is not rebuilt
+        storage.update_index()
+        self.assertEqual(storage._index, self.storage._index)
+
+        # a stale index must be rebuilt
+        with h5py.File(self.storage.filename, 'a') as db:
+            dataset = db.create_dataset('external', data=np.arange(3))
+            dataset.attrs['args'] = json.dumps([3])
+            dataset.attrs['kwargs'] = json.dumps({'e': 2})
+            dataset.attrs['internal_data'] = json.dumps({})
+        storage = StorageHDF5(self.storage.filename)
+        self.assertEqual(len(storage), 2)
+        self.assertEqual(storage.retrieve([3], {'e': 2})[0].tolist(), [0, 1, 2])
+
+        storage = StorageHDF5(self.storage.filename, readonly=True)
+        storage.rebuild_index = None #< make sure the index is not rebuilt
+        storage.update_index()
+        self.assertEqual(len(storage), 2)
+        
+        
+        
+class TestFunctionCacheHDF5Open(TestFunctionCacheHDF5):
+    """ test caches using a hdf5 file that is kept open """            
+            
+    def setUp(self):
+        """ initialize tests """
+        file_tmp = tempfile.NamedTemporaryFile(suffix='hdf5', delete=False)
+        self.storage = StorageHDF5(file_tmp.name, temporary=True,
+                                   keep_open=True, flush_interval=0) 
+        
+        
+    def test_precompute_processes(self):
+        """ test precomputing items in other processes, which must not inherit
+        the open hdf5 file """
+        self.storage.close()
+        super(TestFunctionCacheHDF5Open, self).test_precompute_processes()
+        
+        
+    def test_session(self):
+        """ test opening and closing the hdf5 file explicitly """
+        file_tmp = tempfile.NamedTemporaryFile(suffix='hdf5', delete=False)
+        storage = StorageHDF5(file_tmp.name, temporary=True)
+        self.assertFalse(storage.is_open)
+        
+        @cached(storage)
+        def square(x):
+            return x**2
+        
+        with storage:
+            self.assertTrue(storage.is_open)
+            self.assertEqual(square(2), 4)
+            with storage:
+                self.assertEqual(square(3), 9)
+            self.assertTrue(storage.is_open)
+            self.assertEqual(square(2), 4)
+        self.assertFalse(storage.is_open)
+        
+        # the data must have been written to the file
+        storage2 = StorageHDF5(file_tmp.name, readonly=True)
+        self.assertEqual(len(storage2), 2)
+        self.assertEqual(storage2.retrieve((3,), {})[0], 9)
+
+        
+        
+class TestFunctionCacheHDF5Memmap(TestFunctionCacheHDF5):
+    """ test caches using a hdf5 file whose arrays are memory mapped """            
+            
+    def setUp(self):
+        """ initialize tests """
+        file_tmp = tempfile.NamedTemporaryFile(suffix='hdf5', delete=False)
+        self.storage = StorageHDF5(file_tmp.name, temporary=True, memmap=True) 
+        
+        
+    def test_memmap(self):
+        """ test reading memory mapped arrays """
+        self.storage.store(np.arange(10), (1,))
+        self.storage.store(np.arange(10), (2,), compression='gzip')
+        self.storage.store(np.array(3), (3,))
+        
+        data = self.storage.retrieve((1,), {})[0]
+        self.assertIsInstance(data, np.memmap)
+        self.assertFalse(data.flags.writeable)
+        self.assertEqual(data.tolist(), range(10))
+        data = self.storage.retrieve((1,), {}, selection=np.s_[2:4])[0]
+        self.assertIsInstance(data, np.memmap)
+        self.assertEqual(data.tolist(), [2, 3])
+        
+        # compressed arrays and scalars are read into memory
+        data = self.storage.retrieve((2,), {})[0]
+        self.assertNotIsInstance(data, np.memmap)
+        self.assertEqual(data.tolist(), range(10))
+        self.assertEqual(self.storage.retrieve((3,), {})[0], 3)
+        
+        # the memory map stays valid when the file is cleared
+        data = self.storage.retrieve((1,), {})[0]
+        self.storage.clear()
+        self.assertEqual(data.tolist(), range(10))
+        
+        
+        
+def _calculate_in_process(args):
+    """ calculates an item of a cached function from a separate process and
+    records the calculation in the file `log_file` """
+    filename, log_file = args
+    
+    @cached(StorageHDF5(filename, concurrent=True))
+    def square(x):
+        with open(log_file, 'a') as fp:
+            fp.write('%d\n' % x)
+        time.sleep(0.1)
+        return x**2
+    
+    return square(3)
+        
+        
+        
+def _store_in_process(args):
+    """ stores items in a concurrent hdf5 storage from a separate process """
+    filename, values = args
+    storage = StorageHDF5(filename, concurrent=True)
+    for value in values:
+        storage.store(np.array(value), (value,))
+    return len(storage)
+        
+        
+        
+class TestFunctionCacheHDF5Concurrent(TestFunctionCacheHDF5):
+    """ test caches using a hdf5 file that is shared between processes """            
+            
+    def setUp(self):
+        """ initialize tests """
+        file_tmp = tempfile.NamedTemporaryFile(suffix='hdf5', delete=False)
+        self.storage = StorageHDF5(file_tmp.name, temporary=True,
+                                   concurrent=True) 
+        
+        
+    def test_keep_open(self):
+        """ test that the file cannot be kept open """
+        self.assertRaises(ValueError, self.storage.open)
+        self.assertRaises(ValueError, StorageHDF5, self.storage.filename,
+                          concurrent=True, keep_open=True)
+        
+        
+    def test_refresh(self):
+        """ test refreshing the index with the changes of another storage """
+        storage = StorageHDF5(self.storage.filename, concurrent=True)
+        self.storage.store(np.arange(3), (1,))
+        self.assertEqual(storage.retrieve((1,), {})[0].tolist(), [0, 1, 2])
+        self.assertEqual(len(storage), 1)
+        
+        # only the appended rows of the index are read 
+        storage.store(np.arange(2), (2,))
+        self.assertEqual(self.storage.retrieve((2,), {})[0].tolist(), [0, 1])
+        index_id = self.storage._index_id
+        self.assertEqual(self.storage._index_length, 2)
+        
+        # modified rows lead to reading the full index
+        storage.store(np.arange(4), (1,))
+        self.assertEqual(self.storage.retrieve((1,), {})[0].tolist(),
+                         [0, 1, 2, 3])
+        self.assertEqual(self.storage._index_id, index_id)
+        self.assertEqual(len(self.storage), 2)
+        
+        del storage[storage.get_key((2,), {})]
+        self.assertRaises(KeyError, self.storage.retrieve, (2,), {})
+        self.assertEqual(len(self.storage), 1)
+        
+        # repacking the file rewrites the index
+        storage.repack()
+        self.assertEqual(self.storage.retrieve((1,), {})[0].tolist(),
+                         [0, 1, 2, 3])
+        self.assertNotEqual(self.storage._index_id, index_id)
+        
+        # clearing one storage is seen by the other
+        self.storage.store(np.arange(2), (2,))
+        storage.clear(kwargs={})
+        self.assertRaises(KeyError, self.storage.retrieve, (2,), {})
+        self.storage.clear()
+        self.assertRaises(KeyError, storage.retrieve, (1,), {})
+        
+        
+    def test_single_flight_processes(self):
+        """ test that an item is only calculated by one process """
+        log_file = tempfile.NamedTemporaryFile(suffix='.log', delete=False)
+        log_file.close()
+        pool = multiprocessing.Pool(4)
+        try:
+            results = pool.map(_calculate_in_process,
+                               [(self.storage.filename, log_file.name)] * 4)
+        finally:
+            pool.close()
+            pool.join()
+        
+        self.assertEqual(results, [9] * 4)
+        with open(log_file.name) as fp:
+            self.assertEqual(fp.read(), '3\n')
+        os.remove(log_file.name)
+        
+        
+    def test_processes(self):
+        """ test writing to the storage from several processes """
+        pool = multiprocessing.Pool(4)
+        jobs = [(self.storage.filename, range(i, 40, 4)) for i in range(4)]
+        try:
+            pool.map(_store_in_process, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        
+        self.assertEqual(len(self.storage), 40)
+        for value in range(40):
+            self.assertEqual(self.storage.retrieve((value,), {})[0], value)
+        self.assertEqual(len(self.storage._index_rows), 40)
+
+        
+        
+def _store_in_directory(args):
+    """ stores items in a directory storage from a separate process """
+    directory, values = args
+    storage = StorageDirectory(directory)
+    for value in values:
+        storage.store(np.array(value), (value,))
+    return len(storage)
+        
+        
+        
+class TestFunctionCacheDirectory(TestFunctionCache):
+    """ test caches using a directory as the storage backend """            
+            
+    def setUp(self):
+        """ initialize tests """
+        self.storage = StorageDirectory(tempfile.mkdtemp(), temporary=True)
+        
+        
+    def test_mmap(self):
+        """ test reading memory mapped arrays """
+        storage = StorageDirectory(self.storage.directory, mmap_mode='r')
+        self.storage.store(np.arange(10), (1,))
+        data = storage.retrieve((1,), {})[0]
+        self.assertIsInstance(data, np.memmap)
+        self.assertFalse(data.flags.writeable)
+        self.assertEqual(data.tolist(), range(10))
+        
+        # the memory map stays valid when the item is overwritten
+        self.storage.store(np.arange(5), (1,))
+        self.assertEqual(data.tolist(), range(10))
+        self.assertEqual(storage.retrieve((1,), {})[0].tolist(), range(5))
+        
+        
+    def test_index(self):
+        """ test reading and compacting the index log """
+        self.storage.compact_threshold = 4
+        for i in range(3):
+            self.storage.store(np.arange(i), (1,))
+            self.storage.store(np.arange(i), (2,))
+        self.storage.clear(kwargs={})
+        self.storage.store(np.arange(3), (3,))
+        
+        # the log is compacted after too many outdated lines
+        self.assertLess(self.storage._index_lines, 8)
+        data_dir = os.path.join(self.storage.directory,
+                                StorageDirectory.DATA_DIR)
+        num_files = sum(len(files) for _, _, files in os.walk(data_dir))
+        self.assertEqual(num_files, 2)
+        
+        storage = StorageDirectory(self.storage.directory, readonly=True)
+        self.assertEqual(len(storage), 1)
+        self.assertEqual(storage.retrieve((3,), {})[0].tolist(), [0, 1, 2])
+        self.storage.store(np.arange(2), (2,))
+        self.assertEqual(storage.retrieve((2,), {})[0].tolist(), [0, 1])
+        self.storage.clear()
+        self.assertEqual(len(storage), 0)
+        
+        
+    def test_truncate(self):
+        """ test clearing the storage when it is opened """
+        self.storage.store(np.arange(3), (1,))
+        storage = StorageDirectory(self.storage.directory, truncate=True)
+        self.assertEqual(len(storage), 0)
+        self.storage.refresh_index()
+        self.assertEqual(len(self.storage), 0)
+        
+        
+    def test_clear_while_writing(self):
+        """ test that clearing keeps the files of items being written """
+        key, value = self.storage._prepare_item(np.arange(4), (4,))
+        entry = self.storage._write_item(key, value)
+        self.storage.clear()
+        with self.storage._lock.acquire():
+            self.storage._append_index([entry])
+        self.assertEqual(len(self.storage), 1)
+        self.assertEqual(self.storage.retrieve((4,), {})[0].tolist(), range(4))
+        
+        
+    def test_processes(self):
+        """ test writing to the storage from several processes """
+        pool = multiprocessing.Pool(4)
+        jobs = [(self.storage.directory, range(i, 40, 4)) for i in range(4)]
+        try:
+            pool.map(_store_in_directory, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        
+        self.assertEqual(len(self.storage), 40)
+        for value in range(40):
+            self.assertEqual(self.storage.retrieve((value,), {})[0], value)
+
+        
+        
+def _square_shared(args):
+    """ calculates a square using a cache in the shared memory """
+    storage, x = args
+    
+    @cached(storage)
+    def square(x):
+        return np.array([x**2])
+    
+    return float(square(x)[0])
+        
+        
+        
+class TestFunctionCacheSharedMemory(TestFunctionCache):
+    """ test caches using the shared memory as the storage backend """            
+            
+    def setUp(self):
+        """ initialize tests """
+        self.storage = StorageSharedMemory()
+        
+        
+    def tearDown(self):
+        """ remove the storage from the shared memory """
+        self.storage.unlink()
+        
+        
+    def test_shared(self):
+        """ test sharing the storage between processes """
+        self.assertTrue(self.storage.is_owner)
+        storage = StorageSharedMemory(self.storage.name)
+        self.assertFalse(storage.is_owner)
+        
+        pool = multiprocessing.Pool(2)
+        try:
+            result = pool.map(_square_shared,
+                              [(self.storage, x) for x in range(10)])
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(result, [x**2 for x in range(10)])
+        
+        # the results are available to all processes without copying them
+        self.assertEqual(len(storage), 10)
+        data = storage.retrieve((3,), {})[0]
+        self.assertIsInstance(data, np.memmap)
+        self.assertEqual(data.tolist(), [9])
+        
+        # only the owner removes the storage
+        storage.unlink()
+        self.assertTrue(os.path.isdir(self.storage.directory))
+        self.storage.unlink()
+        self.assertFalse(os.path.isdir(self.storage.directory))
+        
+        
+        
+class TestFunctionCacheSQLite(TestFunctionCache):
+    """ test caches using a sqlite database as the storage backend """            
+            
+    def setUp(self):
+        """ initialize tests """
+        file_tmp = tempfile.NamedTemporaryFile(suffix='.sqlite', delete=False)
+        self.storage = StorageSQLite(file_tmp.name, temporary=True)
+        
+        
+    def test_database(self):
+        """ test the layout of the database """
+        mode = self.storage._db.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+        
+        # selecting items uses the indices of the table
+        for where in ('kwargs_key = 1', 'time_stored < 1'):
+            plan = self.storage._db.execute('EXPLAIN QUERY PLAN SELECT key '
+                                            'FROM items WHERE ' + where)
+            self.assertIn('INDEX', ' '.join(str(row) for row in plan))
+        
+        arr = np.arange(6, dtype=np.float32).reshape(2, 3)
+        self.storage.store(arr, (1,))
+        self.storage.store(np.int8(3), (2,))
+        data = self.storage.retrieve((1,), {})[0]
+        np.testing.assert_array_equal(data, arr)
+        self.assertEqual(data.dtype, np.float32)
+        self.assertEqual(self.storage.retrieve((2,), {})[0], 3)
+        self.assertEqual(np.shape(self.storage.retrieve((2,), {})[0]), ())
+        
+        storage = StorageSQLite(self.storage.filename, readonly=True)
+        self.assertEqual(len(storage), 2)
+        self.assertRaises(IOError, storage.store, arr, (3,))
+        
+        
+        
+class TestFunctionCacheTiered(TestFunctionCache):
+    """ test caches using a memory layer in front of a hdf5 storage """            
+            
+    def setUp(self):
+        """ initialize tests """
+        file_tmp = tempfile.NamedTemporaryFile(suffix='hdf5', delete=False)
+        storage = StorageHDF5(file_tmp.name, temporary=True)
+        self.storage = StorageTiered(storage, StorageMemoryBounded(max_items=2))
+        
+        
+    def test_layers(self):
+        """ test the consistency of the two layers """
+        
+        @cached(self.storage)
+        def square(x):
+            return x**2
+        
+        for x in range(3):
+            square(x)
+        self.assertEqual(len(self.storage.memory), 2)
+        self.assertEqual(len(self.storage), 3)
+        
+        self.assertEqual(square(0), 0)
+        self.assertEqual(self.storage.memory.statistics['misses'], 4)
+        self.assertEqual(square(0), 0)
+        self.assertEqual(self.storage.memory.statistics['hits'], 1)
+        
+        del self.storage[self.storage.get_key((0,), {})]
+        self.assertEqual(len(self.storage.memory), 1)
+        self.assertEqual(len(self.storage), 2)
+        self.assertRaises(KeyError, self.storage.retrieve, (0,), {})
+        
+        self.storage.clear()
+        self.assertEqual(len(self.storage.memory), 0)
+        self.assertEqual(len(self.storage), 0)
+        
+        
+    def test_map_layers(self):
+        """ test reading many items from the memory layer """
+        
+        reads = [] #< keys that are read from the storage at once
+        iter_items = self.storage.storage._iter_items
+        def iter_items_recorded(keys):
+            reads.append(len(keys))
+            return iter_items(keys)
+        self.storage.storage._iter_items = iter_items_recorded
+        
+        @cached(self.storage)
+        def square(x):
+            return x**2
+        
+        self.assertEqual(square.map([1, 2]), [1, 4])
+        self.assertEqual(reads, [2])
+        self.assertEqual(square.map([1, 2]), [1, 4])
+        self.assertEqual(reads, [2])
+        
+        # only the items missing in the memory layer are read
+        self.storage.memory.clear()
+        self.storage.flush()
+        self.assertEqual(square(1), 1)
+        self.assertEqual(square.map([1, 2]), [1, 4])
+        self.assertEqual(reads, [2, 1])
+        self.assertEqual(square.map([1, 2]), [1, 4])
+        self.assertEqual(reads, [2, 1])
+        
+        
+        
+class TestFunctionCacheTieredWriteBehind(TestFunctionCacheTiered):
+    """ test caches using a memory layer that delays writing to the storage """            
+            
+    def setUp(self):
+        """ initialize tests """
+        file_tmp = tempfile.NamedTemporaryFile(suffix='hdf5', delete=False)
+        storage = StorageHDF5(file_tmp.name, temporary=True)
+        self.storage = StorageTiered(storage, StorageMemoryBounded(max_items=2),
+                                     write_behind=True)
+        
+        
+    def test_write_behind(self):
+        """ test delaying writing items to the storage """
+        self.storage.store(1, (1,))
+        self.assertEqual(len(self.storage.storage), 0)
+        self.assertEqual(self.storage.retrieve((1,), {})[0], 1)
+        self.assertEqual(self.storage.retrieve_many([(1,)], {})[0][0], 1)
+        self.assertEqual(len(self.storage.storage), 0)
+        self.storage.flush()
+        self.assertEqual(len(self.storage.storage), 1)
@@ -6,12 +6,15 @@ Created on Nov 7, 2015
 
 from __future__ import division
 
+import multiprocessing.pool
 import tempfile
 
+import numpy as np
+
 from data_storage import StorageMemory, interpolated
 from data_storage.backend.hdf5 import StorageHDF5
 
-from .base import TestBase, SimpleResult
+from .base import TestBase, SimpleResult, Executor
 
       
 
@@ -24,6 +27,19 @@ class TestFunctionInterpolation(TestBase):
     def setUp(self):
         """ initialize tests """
         self.storage = StorageMemory()
+        self.interpolator_storage = StorageMemory()
+
+        
+    def record_iterdata(self):
+        """ returns a list to which the arguments of all calls of the method
+        `iterdata` of the storage are appended """
+        calls = []
+        iterdata = self.storage.iterdata
+        def iterdata_recorded(*args, **kwargs):
+            calls.append(args)
+            return iterdata(*args, **kwargs)
+        self.storage.iterdata = iterdata_recorded
+        return calls
 
     
     def test_1d_1d(self):
@@ -162,6 +178,189 @@ class TestFunctionInterpolation(TestBase):
         self.assertEqual(len(self.storage), 2)
         self.assertAlmostEqual(a, 0.5*(1**2 + 2**3))
 
+
+    def test_incremental(self):
+        """ test that the interpolator is not rebuilt for new points """
+        
+        iterdata_calls = self.record_iterdata()
+        
+        @interpolated(self.storage, max_distance=0.6)
+        def func(x):
+            return x**2
+        
+        for x in range(5):
+            self.assertEqual(func(x), x**2)
+        self.assertAlmostEqual(func(2.5), 0.5*(2**2 + 3**2))
+        self.assertEqual(len(self.storage), 5)
+        self.assertEqual(len(iterdata_calls), 2)
+        
+        
+    def test_kwargs_cache(self):
+        """ test that interpolators are kept for several kwargs """
+        
+        iterdata_calls = self.record_iterdata()
+        
+        decorator = interpolated(self.storage, max_distance=0.6,
+                                 max_interpolators=2)
+        @decorator
+        def func(x, e=2):
+            return x**e
+        
+        for x in [0, 1, 2]:
+            for e in [2, 3]:
+                self.assertEqual(func(x, e=e), x**e)
+        self.assertEqual(len(iterdata_calls), 4)
+        for e in [2, 3]:
+            self.assertAlmostEqual(func(1.5, e=e), 0.5*(1**e + 2**e))
+        self.assertEqual(len(iterdata_calls), 4)
+        
+        # the least recently used interpolator is discarded
+        self.assertEqual(func(0, e=4), 0)
+        self.assertEqual(len(iterdata_calls), 5)
+        self.assertAlmostEqual(func(1.5, e=3), 0.5*(1**3 + 2**3))
+        self.assertEqual(len(iterdata_calls), 5)
+        self.assertAlmostEqual(func(1.5, e=2), 0.5*(1**2 + 2**2))
+        self.assertEqual(len(iterdata_calls), 6)
+
+
+    def test_store_interpolators(self):
+        """ test reading interpolators from the storage """
+        
+        iterdata_calls = self.record_iterdata()
+        
+        def func(x, e=2):
+            return x**e
+        
+        storage = self.interpolator_storage
+        func_int = interpolated(self.storage, max_distance=0.6,
+                                interpolator_storage=storage)(func)
+        for x in range(3):
+            self.assertEqual(func_int(x), x**2)
+        self.assertEqual(len(iterdata_calls), 2)
+        
+        # the stored interpolator is outdated
+        func_int = interpolated(self.storage, max_distance=0.6,
+                                interpolator_storage=storage)(func)
+        self.assertAlmostEqual(func_int(1.5), 0.5*(1**2 + 2**2))
+        self.assertEqual(len(iterdata_calls), 3)
+        self.assertEqual(len(self.storage), 3) #< interpolator stored apart
+        self.assertEqual(len(self.interpolator_storage), 1)
+        
+        # the stored interpolator is read
+        func_int = interpolated(self.storage, max_distance=0.6,
+                                interpolator_storage=storage)(func)
+        self.assertAlmostEqual(func_int(0.5), 0.5*(0**2 + 1**2))
+        self.assertEqual(func_int(5), 5**2)
+        self.assertEqual(len(iterdata_calls), 3)
+        
+        func_int = interpolated(self.storage, max_distance=0.6,
+                                interpolator_storage=storage)(func)
+        self.assertAlmostEqual(func_int(4.5), 2**2 + 2.5/3*(5**2 - 2**2))
+        self.assertEqual(len(iterdata_calls), 4)
+        self.assertEqual(len(self.storage), 4)
+        
+        # the results and the interpolators must be stored separately
+        self.assertRaises(ValueError, interpolated, self.storage,
+                          interpolator_storage=self.storage)
+        
+        
+    def test_store_interpolators_overwritten(self):
+        """ test that overwriting a result outdates stored interpolators """
+        
+        def get_function():
+            """ returns a new interpolated function using the storages """
+            return interpolated(
+                self.storage, max_distance=0.6,
+                interpolator_storage=self.interpolator_storage)(lambda x: x**2)
+            
+        self.assertEqual(get_function().map(range(3)), [0, 1, 4])
+        self.assertAlmostEqual(get_function()(1.5), 2.5) #< stores interpolator
+        self.assertEqual(len(self.interpolator_storage), 1)
+        
+        self.storage.store(100., (1,), {})
+        self.assertEqual(get_function()(1), 100)
+        
+        
+    def test_store_interpolators_cleared(self):
+        """ test that recomputed results outdate stored interpolators """
+        
+        def get_function(e):
+            """ returns a new interpolated function using the storages """
+            return interpolated(
+                self.storage, max_distance=0.6,
+                interpolator_storage=self.interpolator_storage)(lambda x: x**e)
+            
+        self.assertEqual(get_function(2).map(range(3)), [0, 1, 4])
+        self.assertAlmostEqual(get_function(2)(1.5), 2.5)
+        self.assertEqual(len(self.interpolator_storage), 1)
+        
+        self.storage.clear()
+        self.assertEqual(get_function(3).map(range(3)), [0, 1, 8])
+        self.assertAlmostEqual(get_function(3)(1.5), 4.5)
+        
+        
+    def test_map(self):
+        """ test evaluating a function at many points at once """
+        
+        calls = []
+        
+        @interpolated(self.storage, max_distance=0.75)
+        def func(point, e=2):
+            calls.append(point)
+            x, y = point
+            return [x**e, y]
+        
+        self.assertEqual(func.map([]), [])
+        points = [(1, 1), (2, 1), (1, 2), (2, 2)]
+        results = func.map(points)
+        self.assertEqual(len(self.storage), 4)
+        np.testing.assert_allclose(results,
+                                   [[1, 1], [4, 1], [1, 2], [4, 2]])
+        
+        pool = multiprocessing.pool.ThreadPool(2)
+        try:
+            results = func.map([(1.5, 1.5), (2, 2), (4, 4)],
+                               executor=Executor(pool))
+        finally:
+            pool.close()
+        self.assertEqual(len(self.storage), 5)
+        self.assertEqual(calls, points + [(4, 4)])
+        np.testing.assert_allclose(results, [[2.5, 1.5], [4, 2], [16, 4]])
+        
+        # the calculated point is used for interpolation
+        np.testing.assert_allclose(func((3.9, 3.9)), [15.4, 3.9])
+        np.testing.assert_allclose(func.map([(1, 1)], e=3), [[1, 1]])
+        self.assertEqual(len(self.storage), 6)
+        
+        
+    def test_map_repeated(self):
+        """ test evaluating a function at repeated distant points """
+        
+        calls = []
+        
+        @interpolated(self.storage, max_distance=0.5)
+        def func(point):
+            calls.append(point)
+            return 2 * point
+        
+        results = func.map([1, 3, 1, 3, 1])
+        self.assertEqual(calls, [1, 3])
+        self.assertEqual(len(self.storage), 2)
+        np.testing.assert_allclose(results, [2, 6, 2, 6, 2])
+        
+        
+    def test_map_object(self):
+        """ test evaluating a function returning objects at many points """
+
+        @interpolated(self.storage, max_distance=0.6)
+        def func(x, e=2):
+            return SimpleResult(x + e, e)
+        
+        self.assertEqual(func.map([1, 2]), [func(1), func(2)])
+        self.assertEqual(func.map([1.5, 3]),
+                         [SimpleResult(3.5, 2), SimpleResult(5, 2)])
+        self.assertEqual(len(self.storage), 3)
+
    
     def test_object(self):
         """ test caching of objects """
@@ -193,4 +392,6 @@ class TestFunctionInterpolationHDF5(TestFunctionInterpolation):
         """ initialize tests """
         file_tmp = tempfile.NamedTemporaryFile(suffix='hdf5', delete=False)
         self.storage = StorageHDF5(file_tmp.name, temporary=True) 
+        file_tmp = tempfile.NamedTemporaryFile(suffix='hdf5', delete=False)
+        self.interpolator_storage = StorageHDF5(file_tmp.name, temporary=True)
         
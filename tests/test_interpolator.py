@@ -62,4 +62,68 @@ class TestFunctionInterpolation(TestBase):
         
         self.assertEqual(interp(0.01).shape, (3, 2))
         self.assertEqual(interp([0.01, 0.01]).shape, (2, 3, 2))
-                
\ No newline at end of file
+                        
+        
+    def test_distance(self):
+        """ test the distance to the support points """
+        
+        interp = Interpolator([], [])
+        self.assertEqual(interp.get_distance(1), np.inf)
+        
+        interp = Interpolator([3, 0, 1], np.arange(3))
+        self.assertAlmostEqual(interp.get_distance(1.2), 0.2)
+        np.testing.assert_allclose(interp.get_distance([-1, 0.5, 2.5, 5]),
+                                   [1, 0.5, 0.5, 2])
+        
+        points = np.random.randn(20, 3)
+        interp = Interpolator(points, np.random.randn(20))
+        queries = np.random.randn(5, 3)
+        dists = np.linalg.norm(points[None, :, :] - queries[:, None, :],
+                               axis=-1).min(axis=1)
+        self.assertAlmostEqual(interp.get_distance(queries[0]), dists[0])
+        np.testing.assert_allclose(interp.get_distance(queries), dists)
+        
+        
+    def test_add_point(self):
+        """ test adding support points to an interpolator """
+        
+        interp = Interpolator([], [])
+        for x in [0, 2, 1, 3]:
+            interp.add_point(x, [x, x**2])
+            self.assertEqual(interp.get_distance(x), 0)
+        np.testing.assert_allclose(interp([0.5, 2.5]),
+                                   [[0.5, 0.5], [2.5, 6.5]])
+        interp.add_point(4, [4, 16])
+        np.testing.assert_allclose(interp(3.5), [3.5, 12.5])
+        self.assertRaises(ValueError, interp.add_point, 5, 5)
+        
+        points = np.random.randn(30, 2)
+        values = np.random.randn(30)
+        interp = Interpolator(points[:10], values[:10])
+        self.assertEqual(interp([0, 0]).shape, tuple())
+        for point, value in zip(points[10:], values[10:]):
+            interp.add_point(point, value)
+        
+        queries = 0.1 * np.random.randn(5, 2)
+        expected = Interpolator(points, values)
+        np.testing.assert_allclose(interp.get_distance(queries),
+                                   expected.get_distance(queries))
+        np.testing.assert_allclose(interp(queries), expected(queries))
+        
+        
+    def test_storage(self):
+        """ test the storage protocol of interpolators """
+        
+        for points, values in [([2, 0, 1], np.arange(3)),
+                               (np.random.randn(10, 2), np.random.randn(10)),
+                               (np.arange(5), np.random.randn(5, 3, 2))]:
+            interp = Interpolator(points, values)
+            data_array, properties = interp.storage_prepare()
+            restored = Interpolator.storage_retrieve(data_array, properties)
+            self.assertEqual(restored.points_ndim, interp.points_ndim)
+            self.assertEqual(restored.values_shape, interp.values_shape)
+            
+            queries = np.asarray(points)[:2] * 0.9
+            np.testing.assert_allclose(restored.get_distance(queries),
+                                       interp.get_distance(queries))
+            np.testing.assert_allclose(restored(queries), interp(queries))
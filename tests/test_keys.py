@@ -0,0 +1,65 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+'''
+
+from __future__ import division
+
+import pickle
+import unittest
+
+import numpy as np
+
+from data_storage.backend.keys import KeyBuilder, KeyBuilderJSON
+
+      
+      
+class TestKeyBuilder(unittest.TestCase):
+    """ test building keys from function arguments """
+
+    _multiprocess_can_split_ = True #< let nose know that tests can run parallel
+    
+    
+    def test_json_compatibility(self):
+        """ test whether keys agree with the keys built using json """
+        key_builder = KeyBuilder()
+        key_builder_json = KeyBuilderJSON()
+        
+        examples = [(), ((1, 2.5), {}), ((None, True, 10**20), {'e': 2}),
+                    (['a', u'b\xe9', 'c\xc3\xa9'], {'x': [1, {'y': None}]}),
+                    ((float('nan'), float('inf'), -1e-300), {1: 2, 0.5: 3}),
+                    ((np.int64(3), np.float64(0.1)), {'a': {'c': 1, 'b': 2}})]
+        for args in examples:
+            self.assertEqual(key_builder(args), key_builder_json(args))
+            
+            
+    def test_numpy(self):
+        """ test building keys from numpy objects """
+        key_builder = KeyBuilder()
+        
+        self.assertEqual(key_builder((np.int32(3), np.float32(0.5))),
+                         key_builder((3, 0.5)))
+        self.assertEqual(key_builder((np.bool_(True),)), key_builder((True,)))
+        
+        key1 = key_builder((np.arange(3),))
+        self.assertEqual(key1, key_builder((np.array([0, 1, 2]),)))
+        self.assertNotEqual(key1, key_builder((np.arange(3.),)))
+        self.assertNotEqual(key1, key_builder((np.arange(1, 4),)))
+        self.assertNotEqual(key1, key_builder((np.arange(3)[:, None],)))
+        self.assertEqual(key_builder((np.arange(6)[::2],)),
+                         key_builder((np.array([0, 2, 4]),)))
+        
+        
+    def test_pickle(self):
+        """ test pickling key builders using all protocols """
+        key_builder = KeyBuilder()
+        args = ((1, np.arange(3)), {'e': 2})
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            restored = pickle.loads(pickle.dumps(key_builder, protocol))
+            self.assertEqual(restored(args), key_builder(args))
+            
+            
+    def test_unsupported(self):
+        """ test building keys from unsupported objects """
+        self.assertRaises(TypeError, KeyBuilder(), (object(),))
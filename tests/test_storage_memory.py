@@ -0,0 +1,121 @@
+'''
+Created on Oct 18, 2026
+
+@author: David Zwicker <dzwicker@seas.harvard.edu>
+'''
+
+from __future__ import division
+
+import time
+import unittest
+
+import numpy as np
+
+from data_storage import StorageMemoryBounded, cached
+      
+      
+
+class TestStorageMemoryBounded(unittest.TestCase):
+    """ test the eviction of items from the bounded memory storage """
+
+    _multiprocess_can_split_ = True #< let nose know that tests can run parallel
+    
+    
+    def test_lru(self):
+        """ test evicting the least recently used item """
+        storage = StorageMemoryBounded(max_items=2, policy='lru')
+        storage.store(1, (1,))
+        storage.store(2, (2,))
+        storage.retrieve((1,), {})
+        storage.store(3, (3,))
+        
+        self.assertEqual(len(storage), 2)
+        self.assertRaises(KeyError, storage.retrieve, (2,), {})
+        self.assertEqual(storage.retrieve((1,), {})[0], 1)
+        self.assertEqual(storage.statistics,
+                         {'hits': 2, 'misses': 1, 'evictions': 1})
+    
+    
+    def test_lfu(self):
+        """ test evicting the least frequently used item """
+        storage = StorageMemoryBounded(max_items=2, policy='lfu')
+        storage.store(1, (1,))
+        storage.store(2, (2,))
+        storage.retrieve((1,), {})
+        storage.retrieve((1,), {})
+        storage.retrieve((2,), {})
+        storage.store(3, (3,))
+        self.assertRaises(KeyError, storage.retrieve, (2,), {})
+        
+        storage.store(4, (4,))
+        self.assertRaises(KeyError, storage.retrieve, (3,), {})
+        self.assertEqual(storage.retrieve((1,), {})[0], 1)
+        self.assertEqual(storage.retrieve((4,), {})[0], 4)
+        
+        # removing the least frequently used item skips to the next count
+        storage = StorageMemoryBounded(max_items=3, policy='lfu')
+        for n, uses in [(1, 4), (2, 2), (3, 0)]:
+            storage.store(n, (n,))
+            for _ in range(uses):
+                storage.retrieve((n,), {})
+        del storage[storage.get_key((3,), {})]
+        storage.store(4, (4,))
+        storage.retrieve((4,), {})
+        storage.retrieve((4,), {})
+        storage.retrieve((4,), {})
+        storage.store(5, (5,))
+        self.assertRaises(KeyError, storage.retrieve, (2,), {})
+        self.assertEqual(storage.retrieve((1,), {})[0], 1)
+        self.assertEqual(storage.retrieve((4,), {})[0], 4)
+        
+        
+    def test_ttl(self):
+        """ test evicting and expiring items based on the time """
+        storage = StorageMemoryBounded(max_items=2, policy='ttl', ttl=0.05)
+        storage.store(1, (1,))
+        storage.store(2, (2,))
+        storage.retrieve((1,), {})
+        storage.store(3, (3,))
+        self.assertRaises(KeyError, storage.retrieve, (1,), {})
+        self.assertEqual(storage.retrieve((2,), {})[0], 2)
+        
+        time.sleep(0.06)
+        key = storage.get_key((2,), {})
+        self.assertNotIn(key, storage)
+        storage.store(5, (2,)) #< replace the expired item
+        self.assertIn(key, storage)
+        self.assertEqual(len(storage), 1)
+        self.assertEqual(storage.nbytes, np.asarray(5).nbytes)
+        time.sleep(0.06)
+        self.assertEqual(len(storage), 0) #< expired items are not counted
+        self.assertRaises(KeyError, storage.retrieve, (2,), {})
+        storage.store(4, (4,))
+        self.assertEqual(len(storage), 1)
+        
+        
+    def test_max_bytes(self):
+        """ test limiting the memory occupied by the data """
+        storage = StorageMemoryBounded(max_bytes=1000)
+        
+        @cached(storage)
+        def func(n):
+            return np.zeros(n, np.uint8)
+        
+        func(400)
+        func(400)
+        self.assertEqual(storage.nbytes, 400)
+        func(500)
+        self.assertEqual(storage.nbytes, 900)
+        func(200)
+        self.assertEqual(storage.nbytes, 700)
+        self.assertEqual(len(storage), 2)
+        func(2000)
+        self.assertEqual(storage.nbytes, 700)
+        self.assertEqual(len(storage), 2)
+        self.assertEqual(storage.statistics['evictions'], 1)
+        
+        
+    def test_unknown_policy(self):
+        """ test initializing the storage with an unsupported policy """
+        self.assertRaises(ValueError, StorageMemoryBounded, policy='random')
+        self.assertRaises(ValueError, StorageMemoryBounded, max_items=0)